@@ -18,9 +18,15 @@ Logic: Used sha256 check sum of file
 import streamlit as st
 import os
 import base64
-from collections import defaultdict
+import sqlite3
+import time
+from itertools import islice
 from datetime import datetime
-from _1streamlit_duplicate_finder_logic import find_duplicate_files # Import our backend logic
+from _1streamlit_duplicate_finder_logic import ScanWorker, HASH_ALGORITHMS, NON_CRYPTOGRAPHIC_ALGORITHMS, COMPARE_GROUP_THRESHOLD, SAMPLE_STAGES, IMAGE_EXTENSIONS # Import our backend logic
+from _1streamlit_duplicate_finder_cache import HashCache, DEFAULT_CACHE_PATH
+from _1streamlit_duplicate_finder_perceptual import PERCEPTUAL_AVAILABLE, PERCEPTUAL_METHODS, PERCEPTUAL_THRESHOLD
+from _1streamlit_duplicate_finder_thumbnails import ThumbnailCache
+from _1streamlit_duplicate_finder_selection import SelectionModel, SCRIPT_ACTIONS, format_bytes, link_groups, externally_linked
 
 
 # --- Graceful Library Imports for Optional Features ---
@@ -37,17 +43,9 @@ SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 ASSETS_DIR = os.path.join(SCRIPT_DIR, "assets")
 ICON_PATH = os.path.join(ASSETS_DIR, "file_icon.png")
 
-# --- Define supported image extensions for previews ---
-IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.bmp', '.webp')
-
 # --- Helper Functions (Stable) ---
 def update_keep_list(hash_val, path):
-    files_to_keep = st.session_state.files_to_keep.get(hash_val, set())
-    if path in files_to_keep:
-        files_to_keep.discard(path)
-    else:
-        files_to_keep.add(path)
-    st.session_state.files_to_keep[hash_val] = files_to_keep
+    st.session_state.selection.toggle(hash_val, path)
     st.session_state.selection_mode = "Manual Selection"
 
 def display_sidebar_preview():
@@ -64,80 +62,114 @@ def display_sidebar_preview():
 def apply_selection_logic():
     if not st.session_state.get('scan_completed'):
         return
-    duplicates = st.session_state.get('duplicates', {})
-    if not duplicates:
+    selection = st.session_state.get('selection')
+    if selection is None or not selection.duplicates:
         return
     mode = st.session_state.get('selection_mode')
     if mode == "Auto-select (Keep shortest path)":
-        for hash_val, data in duplicates.items():
-            path_to_keep = min(data['paths'], key=len)
-            st.session_state.files_to_keep[hash_val] = {path_to_keep}
+        selection.keep_shortest_paths()
     elif mode == "Manual Selection":
-        st.session_state.files_to_keep = defaultdict(set)
+        selection.clear()
 
-def generate_scan_report():
-    report_lines = []
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    report_lines.append(f"Duplicate File Scan Report\nGenerated on: {timestamp}\n" + "=" * 40)
-    duplicates = st.session_state.get('duplicates', {})
-    files_to_keep = st.session_state.get('files_to_keep', {})
-    if not duplicates:
-        report_lines.append("No duplicate files were found.")
-        return "\n".join(report_lines)
-    for i, (hash_val, data) in enumerate(duplicates.items(), 1):
-        report_lines.append(f"\n--- Set {i} | Hash: {hash_val} ---")
-        kept_in_set = files_to_keep.get(hash_val)
-        if not kept_in_set:
-            report_lines.append("  [UNREVIEWED] This set has not been reviewed.")
-            for path in sorted(data['paths']):
-                report_lines.append(f"    - {path}")
-            continue
-        for path in sorted(data['paths']):
-            status = "[KEEP]" if path in kept_in_set else "[DELETE]"
-            report_lines.append(f"  {status} {path}")
-    return "\n".join(report_lines)
-
-def format_bytes(byte_count):
-    if byte_count is None or byte_count == 0:
-        return "0 B"
-    power, n = 1024, 0
-    power_labels = {0: 'B', 1: 'KB', 2: 'MB', 3: 'GB', 4: 'TB'}
-    while byte_count >= power and n < len(power_labels) - 1:
-        byte_count /= power
-        n += 1
-    return f"{byte_count:.2f} {power_labels[n]}"
-
-# --- UPDATED STATS CALCULATION FUNCTION ---
-def calculate_cleanup_stats():
-    """Calculates the number of files to keep/delete and space saved."""
-    total_files_found = 0
-    files_to_delete = 0
-    files_to_keep = 0
-    space_saved = 0
-    
-    duplicates = st.session_state.get('duplicates', {})
-    selections = st.session_state.get('files_to_keep', {})
+def clear_hash_cache(cache_path, path=None):
+    """Drops the cached hashes for `path` (a file or folder), or all of them."""
+    try:
+        with HashCache(cache_path) as cache:
+            removed = cache.invalidate(path)
+    except (OSError, sqlite3.Error) as e:
+        st.error(f"Could not clear the hash cache: {e}")
+        return
+    st.toast(f"Cleared {removed} cached hashes" + (f" under {path}" if path else "") + ".")
 
-    for hash_val, data in duplicates.items():
-        num_in_set = len(data['paths'])
-        file_size = data['size']
-        
-        total_files_found += num_in_set
-        
-        kept_in_set = selections.get(hash_val, set())
-        num_kept = len(kept_in_set)
-        num_to_delete = num_in_set - num_kept
+def prepared_download(name, build):
+    """
+    Text for a download button, built by `build()` only after the user asks for it
+    and reused until the selection changes. Returns None until it has been prepared.
+    """
+    version = st.session_state.selection.version
+    prepared = st.session_state.setdefault('prepared_downloads', {})
+    if name in prepared and prepared[name][0] == version:
+        return prepared[name][1]
+    if st.session_state.get(f'prepare_{name}'):
+        prepared[name] = (version, build())
+        return prepared[name][1]
+    return None
 
-        files_to_keep += num_kept
-        files_to_delete += num_to_delete
-        space_saved += num_to_delete * file_size
-        
-    return total_files_found, files_to_keep, files_to_delete, space_saved
+# --- Review and hardlink tab paging: only the current page of sets is rendered on each rerun ---
+SORT_OPTIONS = {
+    "reclaimable_desc": "Reclaimable space (largest first)",
+    "reclaimable_asc": "Reclaimable space (smallest first)",
+    "files_desc": "Files per set (most first)",
+    "scan": "Scan order",
+}
+PAGE_SIZES = (10, 25, 50, 100)
+# The script tab only renders this much; the full lists are in the downloads.
+SCRIPT_PREVIEW_LINES = 200
+UNREVIEWED_PREVIEW_SETS = 50
+
+@st.cache_resource
+def get_thumbnail_cache():
+    try:
+        return ThumbnailCache()
+    except OSError:
+        return None  # Unwritable cache folder: fall back to the icon
+
+def reclaimable_bytes(data):
+    """
+    Space freed by keeping only the largest file of a set (hardlinks count once).
+    Files also hardlinked outside the scanned folders free nothing when deleted.
+    """
+    sizes = data.get('sizes', {})
+    outside = data.get('external_links') or {}
+    group_sizes = sorted(sizes.get(group[0], data['size']) for group in link_groups(data) if group[0] not in outside)
+    return sum(group_sizes if outside else group_sizes[:-1])
+
+def get_set_order(sort_by, min_reclaimable, path_filter):
+    """
+    Hashes of the sets to show, filtered and sorted.
+    Cached in session state until the parameters change, so toggling a file
+    does not re-sort every set.
+    """
+    params = (sort_by, min_reclaimable, path_filter)
+    cached = st.session_state.get('set_order_cache')
+    if cached and cached[0] == params:
+        return cached[1]
+    duplicates = st.session_state.get('duplicates', {})
+    if 'set_reclaimable' not in st.session_state:
+        st.session_state.set_reclaimable = {h: reclaimable_bytes(data) for h, data in duplicates.items()}
+    reclaimable = st.session_state.set_reclaimable
+    order = [h for h, data in duplicates.items()
+             if reclaimable[h] >= min_reclaimable and (not path_filter or any(path_filter in p for p in data['paths']))]
+    if sort_by == "reclaimable_desc":
+        order.sort(key=reclaimable.get, reverse=True)
+    elif sort_by == "reclaimable_asc":
+        order.sort(key=reclaimable.get)
+    elif sort_by == "files_desc":
+        order.sort(key=lambda h: len(duplicates[h]['paths']), reverse=True)
+    st.session_state.set_order_cache = (params, order)
+    return order
+
+def show_scan_stats():
+    """Per-stage timings and throughput of the last scan, under the metrics row."""
+    scan_stats = st.session_state.get('scan_stats')
+    if scan_stats is None or not scan_stats.stages:
+        return
+    peak = f", peak memory {format_bytes(scan_stats.peak_rss)}" if scan_stats.peak_rss else ""
+    errors = f", {scan_stats.errors} unreadable" if scan_stats.errors else ""
+    with st.expander(f"Scan statistics — {scan_stats.wall_time:.1f} s, {format_bytes(scan_stats.bytes_read)} read{peak}{errors}"):
+        st.table([{
+            "Stage": stage.name,
+            "Time (s)": f"{stage.wall_time:.2f}",
+            "Files in → out": f"{stage.files_in:,} → {stage.files_out:,}",
+            "Read": format_bytes(stage.bytes_read),
+            "MB/s": f"{stage.mb_per_s:.1f}",
+            "Errors": stage.errors,
+            "Cache hits": stage.cache_hits,
+        } for stage in scan_stats.stages])
 
 # --- Initialize Session State ---
 if 'selection_mode' not in st.session_state: st.session_state.selection_mode = "Manual Selection"
 if 'scan_completed' not in st.session_state: st.session_state.scan_completed = False
-if 'files_to_keep' not in st.session_state: st.session_state.files_to_keep = defaultdict(set)
 
 # --- Main UI ---
 st.title("Duplicate File Finder")
@@ -180,28 +212,67 @@ with st.sidebar:
     if st.session_state.selection_mode == "Manual Selection":
         st.info("You will select files to KEEP.", icon="✍️")
     else:
-        st.info("System will auto-select files to KEEP ie. files with shortest path.", icon="🤖")
+        st.info("System will auto-select files to KEEP ie. files with shortest path (the largest file in similar-image sets).", icon="🤖")
     
     folder_paths_input = st.text_area("Folders to Scan (one per line):", height=70)
     exclude_paths_input = st.text_area("Folders to Exclude (one per line):", height=70)
+    report_hardlinks = st.checkbox("Report hardlink sets", value=False, help="Also list files that are only hardlinked (one copy of the data under several paths). They are shown separately because deleting them frees no space.")
+
+    with st.expander("Hashing", expanded=False):
+        hash_algorithm = st.selectbox("Grouping hash", list(HASH_ALGORITHMS), index=0, help="blake2b is usually faster than sha256; xxh3_128 and blake3 appear when their packages are installed.")
+        confirm_with_sha256 = st.checkbox(
+            "Confirm final groups with SHA-256", value=hash_algorithm in NON_CRYPTOGRAPHIC_ALGORITHMS,
+            disabled=hash_algorithm == 'sha256', help="Only files that already matched with the grouping hash are re-read.")
+        chunk_size_kib = st.select_slider("Read buffer (KiB)", options=[64, 256, 1024, 4096, 8192], value=1024, help="Buffer used for full-file hashing, allocated once per worker thread.")
+        drop_page_cache = st.checkbox("Drop hashed files from page cache", value=True, help="Keeps a large scan from evicting other cached data. Turn off to make an immediate rescan faster.")
+        sample_stages_input = st.text_input("Sampled fingerprint stages", value=", ".join(str(n) for n in SAMPLE_STAGES), help="Comma-separated block counts. After the header check, large files are fingerprinted from their head, tail and this many evenly spaced blocks, once per entry. Leave empty to skip.")
+        compare_threshold = st.number_input("Byte-compare groups of up to N files", min_value=0, max_value=16, value=COMPARE_GROUP_THRESHOLD, help="Small candidate groups are read side by side and dropped at the first differing byte instead of being fully hashed. 0 always hashes.")
+        use_processes = st.checkbox("Hash in separate processes", value=False, help="Useful when hashing, not the disk, is the bottleneck (fast NVMe or files already in cache).")
+
+    with st.expander("Similar Images", expanded=False):
+        find_similar = st.checkbox("Also find visually similar images", value=False, disabled=not PERCEPTUAL_AVAILABLE,
+                                   help="Matches resized, re-encoded or EXIF-stripped copies of images, not only byte-identical files." if PERCEPTUAL_AVAILABLE else "Needs Pillow and NumPy.")
+        perceptual_method = st.selectbox("Perceptual hash", PERCEPTUAL_METHODS, disabled=not find_similar, help="dhash is fastest; phash is more robust to re-encoding and small edits.")
+        perceptual_threshold = st.slider("Max difference (bits of 64)", min_value=0, max_value=16, value=PERCEPTUAL_THRESHOLD, disabled=not find_similar, help="Higher finds more loosely similar images, at the risk of false matches.")
+
+    with st.expander("Hash Cache", expanded=False):
+        use_cache = st.checkbox("Use persistent hash cache", value=True, help="Unchanged files (same inode, size and mtime) are not re-read on the next scan.")
+        cache_path_input = st.text_input("Cache file", value=DEFAULT_CACHE_PATH, disabled=not use_cache, help="Put this on a mounted volume when running in Docker so the cache survives restarts.")
+        verify_cache = st.checkbox("Verify cached hashes", value=False, disabled=not use_cache, help="Re-read every candidate and correct stale cache entries instead of trusting the cache.")
+        clear_cache_path = st.text_input("Clear entries under", value="", disabled=not use_cache, help="A file or folder whose cached hashes are dropped. Leave empty to clear the whole cache.")
+        if st.button("🗑️ Clear cache", disabled=not use_cache or not cache_path_input.strip(), use_container_width=True):
+            clear_hash_cache(cache_path_input.strip(), clear_cache_path.strip() or None)
     
     # --- UPDATED: Start Scan button wrapped in custom class ---
     st.markdown('<div class="st-green-button">', unsafe_allow_html=True)
     if st.button("🚀 Start Scan", use_container_width=True, type="primary" ): # Note: type="primary" is removed
+        if 'scan_worker' in st.session_state:
+            st.session_state.scan_worker.cancel()
         keys_to_keep_state = ['selection_mode']
         for key in list(st.session_state.keys()):
             if key not in keys_to_keep_state: del st.session_state[key]
-        st.session_state.files_to_keep = defaultdict(set)
         include_folders = [p.strip() for p in folder_paths_input.split('\n') if p.strip()]
         valid_folders = [p for p in include_folders if os.path.isdir(p)]
         exclude_folders = [p.strip() for p in exclude_paths_input.split('\n') if p.strip()]
         if not valid_folders:
             st.error("Please provide at least one valid folder to scan.")
         else:
-            with st.spinner("Scanning... This may take a while for large directories..."):
-                st.session_state.duplicates = find_duplicate_files(valid_folders, exclude_folders)
-                st.session_state.scan_completed = True
-                apply_selection_logic()
+            # The scan runs on a background thread; the page polls it below and shows sets as they are confirmed.
+            st.session_state.scan_worker = ScanWorker(
+                valid_folders, exclude_folders,
+                cache_path=cache_path_input.strip() if use_cache and cache_path_input.strip() else None,
+                verify_cache=verify_cache,
+                hash_algorithm=hash_algorithm,
+                confirm_with_sha256=confirm_with_sha256,
+                chunk_size=chunk_size_kib * 1024,
+                drop_page_cache=drop_page_cache,
+                use_processes=use_processes,
+                compare_threshold=int(compare_threshold),
+                report_hardlinks=report_hardlinks,
+                perceptual_method=perceptual_method if find_similar else None,
+                perceptual_threshold=perceptual_threshold,
+                sample_stages=tuple(int(n) for n in sample_stages_input.replace(' ', '').split(',') if n.isdigit()),
+            ).start()
             st.rerun()
     st.markdown('</div>', unsafe_allow_html=True)
     #st.divider()
@@ -221,31 +292,82 @@ with st.sidebar:
         </style>
         """, unsafe_allow_html=True)
 
-    if st.session_state.get('scan_completed', False):
-        st.download_button(
-            label="📄 Download Scan Report",
-            data=generate_scan_report(),
-            file_name=f"duplicate_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt",
-            mime="text/plain",
-            use_container_width=True,
-            type="secondary"  # 🔑 Required for CSS to work
-        )
+    if st.session_state.get('scan_completed', False) and 'selection' in st.session_state:
+        # The report is only assembled when asked for, not on every rerun.
+        report_text = prepared_download('report', lambda: "\n".join(
+            st.session_state.selection.iter_report_lines(st.session_state.get('hardlink_sets'))))
+        if report_text is None:
+            st.button("📄 Prepare Scan Report", key='prepare_report', use_container_width=True)
+        else:
+            st.download_button(
+                label="📄 Download Scan Report",
+                data=report_text,
+                file_name=f"duplicate_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt",
+                mime="text/plain",
+                use_container_width=True,
+                type="secondary"  # 🔑 Required for CSS to work
+            )
         
     if "preview_path" in st.session_state:
         display_sidebar_preview()
 
+# --- Scan in Progress ---
+scan_worker = st.session_state.get('scan_worker')
+if scan_worker is not None:
+    found_so_far = scan_worker.snapshot()
+    if scan_worker.is_running:
+        st.header("Scanning...", divider="rainbow")
+        progress = scan_worker.progress
+        if progress is None:
+            st.progress(0.0, text="Starting scan...")
+        elif progress.files_total:
+            st.progress(min(1.0, progress.files_done / progress.files_total),
+                        text=f"{progress.stage}: {progress.files_done:,} / {progress.files_total:,} files — {format_bytes(progress.bytes_hashed)} read")
+        else:
+            st.progress(0.0, text=f"{progress.stage}: {progress.files_done:,} files found")
+        progress_cols = st.columns([1, 1, 2])
+        progress_cols[0].metric("Duplicate Sets So Far", len(found_so_far))
+        progress_cols[1].metric("Elapsed", f"{int(time.time() - scan_worker.started_at)} s")
+        with progress_cols[2]:
+            st.button("⏹️ Cancel Scan", on_click=scan_worker.cancel, disabled=scan_worker.cancelled)
+        if found_so_far:
+            st.subheader("Latest Duplicate Sets")
+            for hash_val, data in list(found_so_far.items())[-20:][::-1]:
+                st.code("\n".join(sorted(data['paths'])), language='text')
+        time.sleep(0.5)
+        st.rerun()
+    else:
+        del st.session_state.scan_worker
+        st.session_state.duplicates = {h: data for h, data in found_so_far.items() if data.get('algorithm') != 'hardlink'}
+        st.session_state.hardlink_sets = {h: data for h, data in found_so_far.items() if data.get('algorithm') == 'hardlink'}
+        st.session_state.scan_completed = True
+        st.session_state.scan_cancelled = scan_worker.cancelled
+        st.session_state.scan_error = str(scan_worker.error) if scan_worker.error else None
+        st.session_state.scan_stats = scan_worker.stats
+        st.session_state.selection = SelectionModel(st.session_state.duplicates)
+        apply_selection_logic()
+        st.rerun()
+
 # --- Display Results ---
 if st.session_state.get('scan_completed', False):
     duplicates = st.session_state.get('duplicates', {})
+    hardlink_sets = st.session_state.get('hardlink_sets', {})
+    if st.session_state.get('scan_error'):
+        st.error(f"The scan stopped with an error: {st.session_state.scan_error}")
+    elif st.session_state.get('scan_cancelled'):
+        st.warning("The scan was cancelled. Only the duplicate sets confirmed before that are shown.", icon="⏹️")
     if not duplicates:
         st.success("🎉 Hooray! No duplicate files were found.")
+        if hardlink_sets:
+            st.info(f"{len(hardlink_sets)} hardlink sets were found; see the scan report. They use no extra space.", icon="🔗")
     else:
         # --- NEW REORGANIZED DASHBOARD LAYOUT ---
         # Header Section
         st.header("Found Duplicate Files", divider="rainbow")
 
-        # Calculate stats
-        total_found, to_keep, to_delete, space_saved = calculate_cleanup_stats()
+        # Running totals, kept up to date by each selection change
+        selection = st.session_state.selection
+        total_found, to_keep, to_delete, space_saved = selection.total_files, selection.files_kept, selection.files_to_delete, selection.space_saved
 
         # Create metrics in a single row under the header
         metric_cols = st.columns(5)
@@ -254,69 +376,118 @@ if st.session_state.get('scan_completed', False):
         metric_cols[2].metric("Files to Delete", to_delete, delta_color="inverse")
         metric_cols[3].metric("Space Saved", format_bytes(space_saved))
         metric_cols[4].metric("Duplicate Sets", len(duplicates))
+        show_scan_stats()
 
         # Optional: Add some spacing
         #st.subheader("", divider="rainbow")  # Standalone rainbow divider
         #st.write("---" )  # Horizontal line separator
 
-        unreviewed_count = len([h for h, data in duplicates.items() if not st.session_state.files_to_keep.get(h)])
+        unreviewed_count = selection.unreviewed_sets
         tab1_label = "✍️ Review & Select Files"
         tab2_label = f"🗑️ Generate Deletion Script (✅ {to_delete} files)" if unreviewed_count == 0 else f"🗑️ Generate Deletion Script \t (⚠️ {unreviewed_count} unreviewed)"
-        tab1, tab2 = st.tabs([tab1_label, tab2_label])
+        tab_labels = [tab1_label, tab2_label]
+        if hardlink_sets:
+            tab_labels.append(f"🔗 Hardlink Sets ({len(hardlink_sets)})")
+        tabs = st.tabs(tab_labels)
+        tab1, tab2 = tabs[0], tabs[1]
 
         with tab1:
             st.info("Click the icon to toggle between Keep (✅) or Delete (❌).", icon="ℹ️")
-            for i, (hash_val, data) in enumerate(duplicates.items(), 1):
+            if 'set_numbers' not in st.session_state:
+                st.session_state.set_numbers = {h: i for i, h in enumerate(duplicates, 1)}
+            control_cols = st.columns([3, 2, 3, 1])
+            sort_by = control_cols[0].selectbox("Sort by", list(SORT_OPTIONS), format_func=SORT_OPTIONS.get, key='review_sort')
+            min_reclaimable_mb = control_cols[1].number_input("Min. reclaimable (MB)", min_value=0.0, value=0.0, step=1.0, key='review_min_mb')
+            path_filter = control_cols[2].text_input("Path contains", key='review_path_filter')
+            page_size = control_cols[3].selectbox("Per page", PAGE_SIZES, index=1, key='review_page_size')
+            set_order = get_set_order(sort_by, int(min_reclaimable_mb * 1024 * 1024), path_filter.strip())
+            page_count = max(1, -(-len(set_order) // page_size))
+            page = st.number_input(f"Page (of {page_count})", min_value=1, max_value=page_count, value=1, key='review_page') if page_count > 1 else 1
+            page_start = (page - 1) * page_size
+            page_hashes = set_order[page_start:page_start + page_size]
+            st.caption(f"Showing sets {page_start + 1 if page_hashes else 0}–{page_start + len(page_hashes)} of {len(set_order)} (of {len(duplicates)} in total)")
+            thumbnail_cache = get_thumbnail_cache()
+            for hash_val in page_hashes:
+                data = duplicates[hash_val]
+                i = st.session_state.set_numbers[hash_val]
                 paths = data['paths']
-                st.write(f"**Set {i}** ({len(paths)} files) — Hash: `{hash_val[:12]}...`")
+                hardlinked = {path for group in link_groups(data) if len(group) > 1 for path in group}
+                linked_outside = externally_linked(data)
+                inode_note = f", {len(link_groups(data))} distinct files 🔗" if hardlinked else ""
+                if data.get('similar'):
+                    st.write(f"**Set {i}** ≈ similar images ({len(paths)} paths{inode_note}) — {hash_val}")
+                else:
+                    st.write(f"**Set {i}** ({len(paths)} paths{inode_note}) — {data.get('algorithm', 'sha256')}: `{hash_val[:12]}...`")
                 layout_cols = st.columns([2, 5])
                 with layout_cols[0]:
                     thumb_path = paths[0]
                     with st.container():
                         file_ext = os.path.splitext(thumb_path)[1].lower()
-                        image_to_display = thumb_path if file_ext in IMAGE_EXTENSIONS else ICON_PATH
+                        image_to_display = ICON_PATH
+                        if file_ext in IMAGE_EXTENSIONS and thumbnail_cache is not None:
+                            # Content-hash keys can be shared between scans; other keys are only unique per file.
+                            thumb_key = hash_val if data.get('algorithm') in HASH_ALGORITHMS else f"{hash_val}|{thumb_path}"
+                            image_to_display = thumbnail_cache.get(thumb_key, thumb_path) or ICON_PATH
                         st.image(image_to_display, width=100)
                         if file_ext in IMAGE_EXTENSIONS:
                             st.button("🔎", key=f"preview_set_{hash_val}", on_click=lambda p=thumb_path: st.session_state.update(preview_path=p), help="Preview this set in the sidebar")
                             st.markdown(f'<style>div[data-testid="stButton"]>button[data-key="preview_set_{hash_val}"]{{position:absolute;top:4px;right:4px;background-color:rgba(0,0,0,0.5);border:1px solid rgba(255,255,255,0.6);border-radius:50%;width:28px;height:28px;color:white;}}div[data-testid="stButton"]>button[data-key="preview_set_{hash_val}"]:hover{{background-color:rgba(0,0,0,0.7);border-color:white;}}</style>', unsafe_allow_html=True)
                 with layout_cols[1]:
-                    files_kept_in_set = st.session_state.files_to_keep.get(hash_val, set())
+                    files_kept_in_set = selection.kept(hash_val)
                     for path in sorted(paths):
                         is_kept = path in files_kept_in_set
                         file_cols = st.columns([1, 10, 2])
                         with file_cols[0]:
-                            st.button("✅" if is_kept else "❌", key=f"toggle_{path}", on_click=update_keep_list, args=(hash_val, path))
+                            st.button("✅" if is_kept else "❌", key=f"toggle_{hash_val}_{path}", on_click=update_keep_list, args=(hash_val, path))
                         with file_cols[1]:
-                            st.markdown(f'<div class="code-block {"keep-block" if is_kept else "delete-block"}">{path}</div>', unsafe_allow_html=True)
+                            link_mark = " 🔗" if path in hardlinked or path in linked_outside else ""
+                            if path in linked_outside:
+                                link_mark += " (also hardlinked outside the scanned folders; deleting it frees no space)"
+                            st.markdown(f'<div class="code-block {"keep-block" if is_kept else "delete-block"}">{path}{link_mark}</div>', unsafe_allow_html=True)
                         with file_cols[2]:
                             if PYPERCLIP_AVAILABLE:
                                 action_cols = st.columns(2)
-                                action_cols[0].button("📝", key=f"copy_file_{path}", help="Copy File Path", use_container_width=True, on_click=lambda p=path: pyperclip.copy(p) or st.toast("Copied file path!"))
-                                action_cols[1].button("📁", key=f"copy_folder_{path}", help="Copy Folder Path", use_container_width=True, on_click=lambda d=os.path.dirname(path): pyperclip.copy(d) or st.toast("Copied folder path!"))
+                                action_cols[0].button("📝", key=f"copy_file_{hash_val}_{path}", help="Copy File Path", use_container_width=True, on_click=lambda p=path: pyperclip.copy(p) or st.toast("Copied file path!"))
+                                action_cols[1].button("📁", key=f"copy_folder_{hash_val}_{path}", help="Copy Folder Path", use_container_width=True, on_click=lambda d=os.path.dirname(path): pyperclip.copy(d) or st.toast("Copied folder path!"))
         with tab2:
             st.header("Deletion Shell Script")
             st.warning("🚨 **CRITICAL:** Review these commands carefully before running.", icon="⚠️")
+            script_action = st.radio("Action for files not kept", list(SCRIPT_ACTIONS), format_func=SCRIPT_ACTIONS.get, horizontal=True, key='script_action',
+                                     help="Hardlinks and reflinks keep every path but store the data once. ln only works within one filesystem; cp --reflink needs Btrfs, XFS or APFS.")
             if unreviewed_count > 0:
                 with st.expander(f"Unreviewed Sets ({unreviewed_count})", expanded=False):
                     st.warning("Safety Switch: No deletion commands will be generated for below sets, because you decided to DELETE ALL files for below sets, without keeping atleast 1 copy", icon="ℹ️")
-                    for i, (hash_val, data) in enumerate(duplicates.items(), 1):
-                        if not st.session_state.files_to_keep.get(hash_val):
-                            display_list = [f"Set {i} (hash: {hash_val[:12]}...)"]
-                            for path in sorted(data['paths']): display_list.append(f"  {path}")
-                            st.code("\n".join(display_list), language='text')
-            all_commands = []
+                    for i, hash_val, data in islice(selection.unreviewed(), UNREVIEWED_PREVIEW_SETS):
+                        display_list = [f"Set {i} (hash: {hash_val[:12]}...)"]
+                        for path in sorted(data['paths']): display_list.append(f"  {path}")
+                        st.code("\n".join(display_list), language='text')
+                    if unreviewed_count > UNREVIEWED_PREVIEW_SETS:
+                        st.caption(f"... and {unreviewed_count - UNREVIEWED_PREVIEW_SETS} more; see the scan report for the full list.")
             if to_delete > 0:
                 expander_label = f"Reviewed Sets: Generated Deletion Commands ({to_delete} files to delete)"
                 with st.expander(expander_label, expanded=True):
-                    for i, (hash_val, data) in enumerate(duplicates.items(), 1):
-                        files_kept = st.session_state.files_to_keep.get(hash_val, set())
-                        if not files_kept: continue
-                        files_to_delete_list = set(data['paths']) - files_kept
-                        if files_to_delete_list:
-                            all_commands.append(f"# Set {i}: {hash_val[:12]}...")
-                            for path in sorted(list(files_to_delete_list)): all_commands.append(f'rm "{path}"')
-                            all_commands.append("")
-                    st.code("\n".join(all_commands), language="shell")
-                    st.download_button("Download Deletion Script (.sh)", data="\n".join(all_commands), file_name="delete_duplicates.sh", mime="text/x-shellscript", use_container_width=True)
+                    # Only the start of the script is rendered; the full file is built when it is downloaded.
+                    preview_lines = list(islice(selection.iter_script_lines(script_action), SCRIPT_PREVIEW_LINES + 1))
+                    st.code("\n".join(preview_lines[:SCRIPT_PREVIEW_LINES]), language="shell")
+                    if len(preview_lines) > SCRIPT_PREVIEW_LINES:
+                        st.caption(f"Showing the first {SCRIPT_PREVIEW_LINES} lines.")
+                    script_text = prepared_download(f'script_{script_action}', lambda: "\n".join(selection.iter_script_lines(script_action)))
+                    if script_text is None:
+                        st.button("Prepare Deletion Script (.sh)", key=f'prepare_script_{script_action}', use_container_width=True)
+                    else:
+                        st.download_button("Download Deletion Script (.sh)", data=script_text, file_name="delete_duplicates.sh", mime="text/x-shellscript", use_container_width=True)
             if to_delete == 0 and unreviewed_count == 0:
-                st.info("No files are currently marked for deletion.")
\ No newline at end of file
+                st.info("No files are currently marked for deletion.")
+        if hardlink_sets:
+            with tabs[2]:
+                st.info("Each set below is a single file reachable under several paths (hardlinks). Deleting some of these paths frees no space, so they are not part of the cleanup above.", icon="🔗")
+                link_cols = st.columns([3, 1])
+                link_page_size = link_cols[1].selectbox("Per page", PAGE_SIZES, index=1, key='hardlink_page_size')
+                link_page_count = max(1, -(-len(hardlink_sets) // link_page_size))
+                link_page = link_cols[0].number_input(f"Page (of {link_page_count})", min_value=1, max_value=link_page_count, value=1, key='hardlink_page') if link_page_count > 1 else 1
+                link_page_start = (link_page - 1) * link_page_size
+                link_page_sets = list(islice(hardlink_sets.values(), link_page_start, link_page_start + link_page_size))
+                st.caption(f"Showing hardlink sets {link_page_start + 1}–{link_page_start + len(link_page_sets)} of {len(hardlink_sets)}")
+                for i, data in enumerate(link_page_sets, link_page_start + 1):
+                    st.write(f"**Hardlink Set {i}** ({len(data['paths'])} paths, {format_bytes(data['size'])} stored once)")
+                    st.code("\n".join(sorted(data['paths'])), language='text')
@@ -0,0 +1,151 @@
+# _1streamlit_duplicate_finder_cache.py
+
+"""
+Persistent hash cache for the duplicate finder.
+
+Digests are stored in a small SQLite database keyed on (st_dev, st_ino, kind)
+and are only trusted while the file's size and mtime_ns still match, so a
+rescan of an unchanged tree never has to re-read a file.
+The database lives in DEFAULT_CACHE_PATH unless another location is given;
+in Docker, point DUPLICATE_FINDER_CACHE at a mounted volume to keep it between runs.
+"""
+
+import os
+import sqlite3
+
+DEFAULT_CACHE_PATH = os.environ.get(
+    "DUPLICATE_FINDER_CACHE",
+    os.path.join(os.path.expanduser("~"), ".cache", "duplicate_finder", "hash_cache.sqlite3"),
+)
+
+# Bump when the meaning of stored digests changes; older databases are wiped on open.
+SCHEMA_VERSION = 1
+
+# Number of pending writes buffered before they are committed in one transaction.
+FLUSH_EVERY = 5000
+
+
+def _to_int64(value):
+    # st_dev/st_ino are unsigned 64-bit on some filesystems, SQLite integers are signed.
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+class HashCache:
+    """SQLite-backed store of partial/full digests, keyed on file identity."""
+
+    def __init__(self, db_path=DEFAULT_CACHE_PATH):
+        self.db_path = os.path.abspath(db_path)
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        self.conn = sqlite3.connect(self.db_path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self._ensure_schema()
+        self._pending = []
+        self.hits = 0
+        self.misses = 0
+
+    def _ensure_schema(self):
+        version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+        if version != SCHEMA_VERSION:
+            self.conn.execute("DROP TABLE IF EXISTS digests")
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS digests (
+                   dev INTEGER NOT NULL,
+                   ino INTEGER NOT NULL,
+                   kind TEXT NOT NULL,
+                   size INTEGER NOT NULL,
+                   mtime_ns INTEGER NOT NULL,
+                   path TEXT NOT NULL,
+                   digest TEXT NOT NULL,
+                   PRIMARY KEY (dev, ino, kind)
+               ) WITHOUT ROWID"""
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS digests_path ON digests(path)")
+        self.conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        self.conn.commit()
+
+    def get(self, kind, dev, ino, size, mtime_ns):
+        """Returns the cached digest, or None if missing or the file has changed since."""
+        row = self.conn.execute(
+            "SELECT size, mtime_ns, digest FROM digests WHERE dev = ? AND ino = ? AND kind = ?",
+            (_to_int64(dev), _to_int64(ino), kind),
+        ).fetchone()
+        if row is None or row[0] != size or row[1] != mtime_ns:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return row[2]
+
+    def put(self, kind, dev, ino, size, mtime_ns, path, digest):
+        """Records a digest; an entry for the same inode with an older size/mtime is replaced."""
+        self._pending.append((_to_int64(dev), _to_int64(ino), kind, size, mtime_ns, path, digest))
+        if len(self._pending) >= FLUSH_EVERY:
+            self.flush()
+
+    def flush(self):
+        if self._pending:
+            self.conn.executemany("INSERT OR REPLACE INTO digests VALUES (?, ?, ?, ?, ?, ?, ?)", self._pending)
+            self._pending = []
+        self.conn.commit()
+
+    def invalidate(self, path=None):
+        """Drops the entries recorded for `path` (or under it, for a folder), or everything if no path is given."""
+        self.flush()
+        if path is None:
+            removed = self.conn.execute("DELETE FROM digests").rowcount
+        else:
+            path = os.path.abspath(os.path.normpath(path))
+            lower, upper = path + os.sep, path + chr(ord(os.sep) + 1)
+            removed = self.conn.execute(
+                "DELETE FROM digests WHERE path = ? OR (path > ? AND path < ?)", (path, lower, upper)
+            ).rowcount
+        self.conn.commit()
+        return removed
+
+    def prune(self, roots=None, seen_inodes=None):
+        """
+        Removes entries for files that were deleted or replaced.
+        Only entries under `roots` are checked when given; (st_dev, st_ino) pairs in
+        `seen_inodes` were just stat'ed by a scan and are skipped, so pruning after
+        a scan only touches files that disappeared from the tree.
+        """
+        self.flush()
+        seen = {(_to_int64(dev), _to_int64(ino)) for dev, ino in (seen_inodes or ())}
+        if roots is None:
+            rows = self.conn.execute("SELECT dev, ino, kind, size, mtime_ns, path FROM digests").fetchall()
+        else:
+            rows = []
+            for root in roots:
+                root = os.path.abspath(os.path.normpath(root))
+                lower, upper = root + os.sep, root + chr(ord(os.sep) + 1)
+                rows.extend(self.conn.execute(
+                    "SELECT dev, ino, kind, size, mtime_ns, path FROM digests WHERE path > ? AND path < ?",
+                    (lower, upper),
+                ).fetchall())
+
+        stale = []
+        for dev, ino, kind, size, mtime_ns, path in rows:
+            if (dev, ino) in seen:
+                continue
+            try:
+                st = os.stat(path, follow_symlinks=False)
+                if (_to_int64(st.st_dev), _to_int64(st.st_ino), st.st_size, st.st_mtime_ns) == (dev, ino, size, mtime_ns):
+                    continue
+            except OSError:
+                pass
+            stale.append((dev, ino, kind))
+
+        if stale:
+            self.conn.executemany("DELETE FROM digests WHERE dev = ? AND ino = ? AND kind = ?", stale)
+        self.conn.commit()
+        return len(stale)
+
+    def close(self):
+        self.flush()
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,100 @@
+# _1streamlit_duplicate_finder_filetable.py
+
+"""
+Compact in-memory index of the files found by a scan.
+
+A tree of 10M+ files kept as full path strings and stat_result objects costs
+several GB. Here every file is an integer ID into a set of typed arrays: the
+directory is an interned index (each directory string is stored once), the
+file name is a slice of one shared byte buffer, and size, device, inode and
+mtime are machine integers. The hashing stages pass IDs around and only turn
+them into path strings when a file is opened or a result is reported.
+"""
+
+import os
+from array import array
+
+try:
+    import resource
+    RESOURCE_AVAILABLE = True
+except ImportError:  # Windows
+    RESOURCE_AVAILABLE = False
+
+
+class FileTable:
+    """Columnar table of files: path (directory ID + name), size, st_dev, st_ino, st_mtime_ns and st_nlink."""
+
+    def __init__(self):
+        self.dirs = []
+        self._dir_ids = {}
+        self.dir_ids = array('I')
+        self._names = bytearray()
+        self._name_ends = array('Q')
+        self.sizes = array('Q')
+        self.devs = array('Q')
+        self.inodes = array('Q')
+        self.mtimes_ns = array('q')
+        self.nlinks = array('I')
+
+    def __len__(self):
+        return len(self.sizes)
+
+    def intern_dir(self, dir_path):
+        """ID of `dir_path`, adding it on first use."""
+        dir_id = self._dir_ids.get(dir_path)
+        if dir_id is None:
+            dir_id = self._dir_ids[dir_path] = len(self.dirs)
+            self.dirs.append(dir_path)
+        return dir_id
+
+    def add(self, dir_id, name, size, dev, ino, mtime_ns, nlink=1):
+        """Appends a file and returns its ID."""
+        self.dir_ids.append(dir_id)
+        self._names += os.fsencode(name)
+        self._name_ends.append(len(self._names))
+        self.sizes.append(size)
+        self.devs.append(dev)
+        self.inodes.append(ino)
+        self.mtimes_ns.append(mtime_ns)
+        self.nlinks.append(nlink)
+        return len(self.sizes) - 1
+
+    def name(self, file_id):
+        start = self._name_ends[file_id - 1] if file_id else 0
+        return os.fsdecode(bytes(self._names[start:self._name_ends[file_id]]))
+
+    def path(self, file_id):
+        return os.path.join(self.dirs[self.dir_ids[file_id]], self.name(file_id))
+
+    def columns(self):
+        """The table as {column name: array or bytes}, e.g. for writing it to a manifest."""
+        return {'dirs': b'\0'.join(os.fsencode(d) for d in self.dirs), 'dir_ids': self.dir_ids,
+                'names': bytes(self._names), 'name_ends': self._name_ends, 'sizes': self.sizes,
+                'devs': self.devs, 'inodes': self.inodes, 'mtimes_ns': self.mtimes_ns, 'nlinks': self.nlinks}
+
+    @classmethod
+    def from_columns(cls, columns):
+        """Rebuilds a table from the output of columns()."""
+        table = cls()
+        table.dirs = [os.fsdecode(d) for d in columns['dirs'].split(b'\0')] if columns['dirs'] else []
+        table._dir_ids = {d: i for i, d in enumerate(table.dirs)}
+        table.dir_ids = columns['dir_ids']
+        table._names = bytearray(columns['names'])
+        table._name_ends = columns['name_ends']
+        table.sizes, table.devs = columns['sizes'], columns['devs']
+        table.inodes, table.mtimes_ns = columns['inodes'], columns['mtimes_ns']
+        table.nlinks = columns['nlinks']
+        return table
+
+    def cache_key(self, file_id):
+        """(st_dev, st_ino, size, mtime_ns), the arguments HashCache uses to validate an entry."""
+        return self.devs[file_id], self.inodes[file_id], self.sizes[file_id], self.mtimes_ns[file_id]
+
+
+def peak_rss_bytes():
+    """Peak resident set size of this process so far, or None where getrusage is unavailable."""
+    if not RESOURCE_AVAILABLE:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes.
+    return peak if os.uname().sysname == 'Darwin' else peak * 1024
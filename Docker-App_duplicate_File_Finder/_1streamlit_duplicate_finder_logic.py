@@ -2,40 +2,567 @@
 
 import os
 import hashlib
-from collections import defaultdict
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import platform
+import threading
+import time
+from collections import defaultdict, namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from functools import partial
+from _1streamlit_duplicate_finder_cache import HashCache
+from _1streamlit_duplicate_finder_scheduler import DeviceScheduler
+from _1streamlit_duplicate_finder_filetable import FileTable, peak_rss_bytes
+from _1streamlit_duplicate_finder_stats import ScanStats
+from _1streamlit_duplicate_finder_manifest import write_manifest
+from _1streamlit_duplicate_finder_perceptual import find_similar_images, PERCEPTUAL_THRESHOLD
+
+# --- Graceful Library Imports for Optional Hash Backends ---
+try:
+    import xxhash
+    XXHASH_AVAILABLE = True
+except ImportError:
+    XXHASH_AVAILABLE = False
+
+try:
+    import blake3
+    BLAKE3_AVAILABLE = True
+except ImportError:
+    BLAKE3_AVAILABLE = False
 
 # ... (rest of the file is unchanged, only find_duplicate_files is modified) ...
 CHUNK_SIZE_SMALL = 4096
-CHUNK_SIZE_LARGE = 65536
+# Full hashing reads into one reused buffer per thread, so a larger chunk only costs memory once per worker.
+CHUNK_SIZE_LARGE = 1024 * 1024
+# Sampled fingerprint stages run after the head-only partial hash: each entry is the number
+# of evenly spaced blocks hashed in addition to the head and tail block. Files smaller than
+# SAMPLE_MIN_FILE_SIZE skip them; reading them in full is about as cheap as seeking around.
+SAMPLE_STAGES = (8,)
+SAMPLE_MIN_FILE_SIZE = 1024 * 1024
+# --- Supported image extensions (previews and perceptual matching) ---
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.bmp', '.webp')
+
+# Candidate groups with at most this many files are compared byte by byte instead of hashed.
+COMPARE_GROUP_THRESHOLD = 3
+
+# --- Hash algorithms: name -> constructor returning an object with update()/hexdigest() ---
+HASH_ALGORITHMS = {
+    'sha256': hashlib.sha256,
+    'blake2b': hashlib.blake2b,
+}
+if BLAKE3_AVAILABLE:
+    HASH_ALGORITHMS['blake3'] = blake3.blake3
+if XXHASH_AVAILABLE:
+    HASH_ALGORITHMS['xxh3_128'] = xxhash.xxh3_128
 
-def get_small_hash(path):
-    # ... (unchanged)
+# Algorithms whose digests are not collision resistant and should be confirmed before deleting anything.
+NON_CRYPTOGRAPHIC_ALGORITHMS = {'xxh3_128'}
+
+def get_small_hash(path, algorithm='sha256', chunk_size=CHUNK_SIZE_SMALL):
     try:
-        with open(path, 'rb') as f:
-            chunk = f.read(CHUNK_SIZE_SMALL)
-            return hashlib.sha256(chunk).hexdigest()
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            chunk = os.read(fd, chunk_size)
+        finally:
+            os.close(fd)
+        hasher = HASH_ALGORITHMS[algorithm]()
+        hasher.update(chunk)
+        return hasher.hexdigest()
     except (IOError, OSError):
         return None
 
-def get_full_hash(path):
-    # ... (unchanged)
-    hasher = hashlib.sha256()
+def sample_offsets(size, samples, block_size):
+    """Offsets of the head block, `samples` evenly spaced blocks and the tail block of a file."""
+    last = size - block_size
+    return [0] + [last * i // (samples + 1) for i in range(1, samples + 1)] + [last]
+
+def get_sample_hash(path, algorithm='sha256', samples=8, block_size=CHUNK_SIZE_SMALL):
+    """
+    Fingerprints a file from its head, its tail and `samples` blocks spread evenly in
+    between, read with positioned reads (os.pread), so files that only share a
+    header are told apart without reading them in full.
+    Files no larger than the sampled blocks combined are hashed whole.
+    """
     try:
-        with open(path, 'rb') as f:
-            while chunk := f.read(CHUNK_SIZE_LARGE):
-                hasher.update(chunk)
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            size = os.fstat(fd).st_size
+            hasher = HASH_ALGORITHMS[algorithm]()
+            if size <= block_size * (samples + 2):
+                hasher.update(os.pread(fd, size, 0))
+            else:
+                for offset in sample_offsets(size, samples, block_size):
+                    hasher.update(os.pread(fd, block_size, offset))
+            return hasher.hexdigest()
+        finally:
+            os.close(fd)
+    except (IOError, OSError):
+        return None
+
+_thread_local = threading.local()
+
+def _get_read_buffer(size):
+    """Returns this thread's preallocated read buffer, (re)allocating it only when the size changes."""
+    buffer = getattr(_thread_local, 'buffer', None)
+    if buffer is None or len(buffer) != size:
+        buffer = bytearray(size)
+        _thread_local.buffer = buffer
+    return buffer
+
+def _fadvise(fd, advice):
+    # posix_fadvise is a hint only and missing on macOS/Windows.
+    if hasattr(os, 'posix_fadvise'):
+        try:
+            os.posix_fadvise(fd, 0, 0, advice)
+        except OSError:
+            pass
+
+def get_full_hash(path, algorithm='sha256', chunk_size=CHUNK_SIZE_LARGE, drop_page_cache=True):
+    """
+    Hashes the whole file with readinto() into this thread's reusable buffer,
+    so no new bytes object is created per chunk.
+    The kernel is told the read is sequential (larger readahead) and, with
+    drop_page_cache, that the pages are not needed afterwards, so hashing a large
+    archive does not push everyone else's data out of the page cache.
+    """
+    hasher = HASH_ALGORITHMS[algorithm]()
+    buffer = _get_read_buffer(chunk_size)
+    view = memoryview(buffer)
+    try:
+        with open(path, 'rb', buffering=0) as f:
+            fd = f.fileno()
+            if hasattr(os, 'POSIX_FADV_SEQUENTIAL'):
+                _fadvise(fd, os.POSIX_FADV_SEQUENTIAL)
+            while n := f.readinto(buffer):
+                hasher.update(view[:n])
+            if drop_page_cache and hasattr(os, 'POSIX_FADV_DONTNEED'):
+                _fadvise(fd, os.POSIX_FADV_DONTNEED)
         return hasher.hexdigest()
     except (IOError, OSError):
         return None
+    finally:
+        view.release()
 
-def find_duplicate_files(folder_paths: list[str], exclude_paths: list[str] = None) -> dict:
+def _fill_chunk(f, buffer):
     """
-    Finds duplicate files in the given folders, respecting an exclusion list.
-    NOW RETURNS: {hash: {'paths': [path1, path2], 'size': file_size_in_bytes}}
+    Fills buffer from f with readinto(), repeating short reads (FUSE and SMB mounts may
+    return less than asked before the end of the file), so chunks of files read side by
+    side stay aligned. At the end of the file the buffer is cut to the bytes read.
+    """
+    n = 0
+    with memoryview(buffer) as view:
+        while n < len(buffer) and (read := f.readinto(view[n:])):
+            n += read
+    del buffer[n:]
+    return buffer
+
+def compare_files_lockstep(paths, algorithm=None, chunk_size=CHUNK_SIZE_LARGE, drop_page_cache=True):
+    """
+    Reads same-size files side by side, one chunk at a time, and splits them into
+    groups of identical content. A file stops being read as soon as it differs from
+    every other candidate, so two videos that diverge at byte 10 MB cost 10 MB each,
+    not their full size. Unreadable files are dropped. Each file is read into its own
+    reusable buffer, filled completely before chunks are compared.
+    With `algorithm`, each group's digest is computed in the same pass; members of a
+    group share every chunk, so one hasher per group is enough.
+    Returns [(digest or None, [paths]), ...] for groups of two or more files.
+    """
+    files = {}
+    buffers = {}
+    try:
+        for path in paths:
+            try:
+                f = open(path, 'rb', buffering=0)
+            except OSError:
+                continue
+            files[path] = f
+            buffers[path] = bytearray(chunk_size)
+            if hasattr(os, 'POSIX_FADV_SEQUENTIAL'):
+                _fadvise(f.fileno(), os.POSIX_FADV_SEQUENTIAL)
+
+        def close(path):
+            f = files.pop(path)
+            buffers.pop(path)
+            if drop_page_cache and hasattr(os, 'POSIX_FADV_DONTNEED'):
+                _fadvise(f.fileno(), os.POSIX_FADV_DONTNEED)
+            f.close()
+
+        matched = []
+        active = [(list(files), HASH_ALGORITHMS[algorithm]() if algorithm else None)]
+        while active:
+            next_active = []
+            for members, hasher in active:
+                # Few files per group, so a linear scan with bytes equality (memcmp) beats hashing the chunks.
+                partitions = []
+                for path in members:
+                    try:
+                        chunk = _fill_chunk(files[path], buffers[path])
+                    except OSError:
+                        close(path)
+                        continue
+                    for part_chunk, part_members in partitions:
+                        if part_chunk == chunk:
+                            part_members.append(path)
+                            break
+                    else:
+                        partitions.append((chunk, [path]))
+
+                for chunk, part_members in partitions:
+                    if len(part_members) < 2:
+                        close(part_members[0])
+                        continue
+                    part_hasher = None
+                    if hasher is not None:
+                        part_hasher = hasher.copy() if len(partitions) > 1 else hasher
+                        part_hasher.update(chunk)
+                    if chunk:
+                        next_active.append((part_members, part_hasher))
+                    else:
+                        matched.append((part_hasher.hexdigest() if part_hasher else None, part_members))
+                        for path in part_members:
+                            close(path)
+            active = next_active
+        return matched
+    finally:
+        for f in files.values():
+            f.close()
+
+def _scan_directory(dir_path, excluded_dirs):
+    """
+    Lists one directory, returning (dir_path, regular files as (name, stat), subdirectories
+    to descend into, number of entries or directories that could not be read).
+    """
+    files, subdirs = [], []
+    errors = 0
+    try:
+        with os.scandir(dir_path) as it:
+            for entry in it:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if entry.path not in excluded_dirs:
+                            subdirs.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        files.append((entry.name, entry.stat(follow_symlinks=False)))
+                except OSError:
+                    errors += 1 # Vanished or unreadable entry
+    except OSError:
+        errors += 1 # Unreadable directory
+    return dir_path, files, subdirs, errors
+
+def discover_files(roots: list[str], excluded_dirs: set[str], max_workers: int = None,
+                   progress=None, cancel_event=None, stage=None):
+    """
+    Walks `roots` with os.scandir in a thread pool, one task per directory, and records
+    every file in a FileTable straight from the DirEntry stat data.
+    Symlinks are neither followed nor reported and empty files are skipped.
+    `excluded_dirs` holds normalized absolute paths; a matching directory is pruned
+    before it is listed, so nothing below it is ever visited.
+    Hardlinks are collapsed: only the first ID seen for each (st_dev, st_ino) is
+    indexed, so every inode is hashed once, and `hardlinks` maps that representative
+    ID to the IDs of all paths of the inode. st_nlink is kept in the table, so links
+    outside the scanned folders can be told apart ('external_links' in find_duplicate_files).
+    progress/cancel_event behave as in iter_duplicate_groups; a cancelled walk
+    returns what it has found so far. `stage` (a StageStats) counts the files seen
+    and the directories or entries that could not be read.
+    Returns (table, [[file ID, ...] per size shared by two or more inodes], {representative ID: [IDs]}).
+    """
+    table = FileTable()
+    first_of_size = {}  # size -> first ID; a list is only made once a second file has the size
+    files_by_size = {}
+    hardlinks = {}
+    first_link = {}
+    files_indexed = 0
+    reporter = _ProgressReporter(progress, "Discovering files")
+
+    def is_excluded(path):
+        # Roots may sit below an excluded folder; subdirectories are checked on the way down.
+        while True:
+            if path in excluded_dirs:
+                return True
+            parent = os.path.dirname(path)
+            if parent == path:
+                return False
+            path = parent
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = {executor.submit(_scan_directory, root, excluded_dirs) for root in roots if not is_excluded(root)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                dir_path, files, subdirs, errors = future.result()
+                if stage is not None:
+                    stage.files_in += len(files)
+                    stage.errors += errors
+                dir_id = table.intern_dir(dir_path) if files else None
+                for name, st in files:
+                    if st.st_size > 0:
+                        file_id = table.add(dir_id, name, st.st_size, st.st_dev, st.st_ino, st.st_mtime_ns, st.st_nlink)
+                        if st.st_nlink > 1:
+                            representative = first_link.setdefault((st.st_dev, st.st_ino), file_id)
+                            if representative != file_id:
+                                hardlinks.setdefault(representative, [representative]).append(file_id)
+                                continue
+                        files_indexed += 1
+                        other = first_of_size.setdefault(st.st_size, file_id)
+                        if other != file_id:
+                            group = files_by_size.get(st.st_size)
+                            if group is None:
+                                files_by_size[st.st_size] = [other, file_id]
+                            else:
+                                group.append(file_id)
+                if cancel_event is not None and cancel_event.is_set():
+                    continue
+                for subdir in subdirs:
+                    pending.add(executor.submit(_scan_directory, subdir, excluded_dirs))
+            reporter.update(files_indexed, 0, 0)
+    reporter.update(files_indexed, files_indexed, 0, force=True)
+
+    return table, list(files_by_size.values()), hardlinks
+
+# --- Progress reporting ---
+# files_total is 0 while it is not known yet (during discovery).
+ScanProgress = namedtuple('ScanProgress', ['stage', 'files_done', 'files_total', 'bytes_hashed'])
+
+# Minimum seconds between two progress callbacks of the same stage.
+PROGRESS_INTERVAL = 0.1
+
+class _ProgressReporter:
+    """Throttles ScanProgress events so a callback is not invoked once per file."""
+
+    def __init__(self, callback, stage):
+        self.callback = callback
+        self.stage = stage
+        self.last_emit = 0.0
+
+    def update(self, files_done, files_total, bytes_hashed, force=False):
+        if self.callback is None:
+            return
+        now = time.monotonic()
+        if force or now - self.last_emit >= PROGRESS_INTERVAL:
+            self.last_emit = now
+            self.callback(ScanProgress(self.stage, files_done, files_total, bytes_hashed))
+
+def _hash_groups(groups, hash_func, cache, cache_kind, table, verify_cache, scheduler,
+                 read_size=None, reporter=None, cancel_event=None, stage=None, record=None):
+    """
+    Hashes every file of the candidate `groups` (lists of FileTable IDs) through the
+    device scheduler and yields {digest: [IDs]} for each input group as soon as its last
+    member is done, so callers can act on a group without waiting for the whole stage.
+    With a cache, a file whose (dev, inode, size, mtime) is unchanged is taken from it
+    without being read, unless verify_cache is set, in which case it is re-hashed
+    and the cache entry is corrected if it disagrees.
+    read_size is the number of bytes hash_func reads per file (None means the whole file).
+    Stops early, without yielding the unfinished groups, once cancel_event is set.
+    `stage` (a StageStats), if given, counts the bytes read and the files that could not be hashed;
+    a MemoryError in a worker is raised instead, so the scan fails rather than dropping files.
+    record(kind, file ID, digest), if given, is called for every digest obtained (e.g. for a manifest).
+    """
+    def bytes_read(file_id):
+        size = table.sizes[file_id]
+        return size if read_size is None else min(read_size, size)
+
+    files_total = sum(len(ids) for ids in groups)
+    files_done = 0
+    bytes_hashed = 0
+    group_of = {}
+    remaining = []
+    results = []
+    ids_to_hash = []
+    cached_digests = {}
+    for group_index, ids in enumerate(groups):
+        remaining.append(len(ids))
+        results.append(defaultdict(list))
+        for file_id in ids:
+            group_of[file_id] = group_index
+            digest = None
+            if cache is not None:
+                digest = cache.get(cache_kind, *table.cache_key(file_id))
+            if digest is not None and not verify_cache:
+                results[group_index][digest].append(file_id)
+                if record is not None:
+                    record(cache_kind, file_id, digest)
+                remaining[group_index] -= 1
+                files_done += 1
+            else:
+                if cache is not None:
+                    cached_digests[file_id] = digest
+                ids_to_hash.append(file_id)
+
+    # Groups served entirely from the cache are complete already.
+    for group_index, count in enumerate(remaining):
+        if count == 0:
+            yield results[group_index]
+            results[group_index] = None
+
+    completed = scheduler.run(
+        hash_func, ids_to_hash,
+        device_of=table.devs.__getitem__,
+        order_of=table.inodes.__getitem__,
+        cost_of=bytes_read,
+        arg_of=table.path,
+    )
+    for file_id, future in completed:
+        if cancel_event is not None and cancel_event.is_set():
+            completed.close()
+            return
+        group_index = group_of.pop(file_id)
+        try:
+            digest = future.result()
+        except MemoryError:
+            raise  # Out of memory (e.g. the CLI's --max-memory) is not an unreadable file
+        except Exception:
+            digest = None
+        if digest:
+            results[group_index][digest].append(file_id)
+            if record is not None:
+                record(cache_kind, file_id, digest)
+            if cache is not None and digest != cached_digests.pop(file_id):
+                cache.put(cache_kind, *table.cache_key(file_id), table.path(file_id), digest)
+        elif stage is not None:
+            stage.errors += 1  # Unreadable or vanished; dropped from the candidates
+        files_done += 1
+        bytes_hashed += bytes_read(file_id)
+        if stage is not None:
+            stage.bytes_read += bytes_read(file_id)
+        if reporter is not None:
+            reporter.update(files_done, files_total, bytes_hashed)
+        remaining[group_index] -= 1
+        if remaining[group_index] == 0:
+            yield results[group_index]
+            results[group_index] = None
+
+    if reporter is not None:
+        reporter.update(files_done, files_total, bytes_hashed, force=True)
+
+def _compare_groups(groups, algorithm, chunk_size, drop_page_cache, cache, table, verify_cache,
+                    scheduler, reporter=None, cancel_event=None, stage=None, record=None):
+    """
+    Byte-compares each (label, [IDs]) candidate group with compare_files_lockstep
+    through the device scheduler and yields {key: [IDs]} per input group.
+    With `algorithm`, keys are digests computed in the same pass (and stored in the
+    cache); otherwise they are '<label>:<size>:<n>', the size keeping groups that only
+    share a head hash apart. A group whose members all have cached
+    full digests is answered from the cache without reading anything.
+    `stage` (a StageStats), if given, counts the bytes compared and groups that failed.
+    record: as in _hash_groups, called for every digest when `algorithm` is set.
+    """
+    cache_kind = f"full:{algorithm}"
+    files_total = sum(len(ids) for _, ids in groups)
+    files_done = 0
+    bytes_compared = 0
+    groups_to_compare = []
+    for label, ids in groups:
+        if cache is not None and algorithm and not verify_cache:
+            cached = {}
+            for file_id in ids:
+                digest = cache.get(cache_kind, *table.cache_key(file_id))
+                if digest is None:
+                    break
+                cached[file_id] = digest
+            if len(cached) == len(ids):
+                digests = defaultdict(list)
+                for file_id, digest in cached.items():
+                    digests[digest].append(file_id)
+                    if record is not None:
+                        record(cache_kind, file_id, digest)
+                files_done += len(ids)
+                yield digests
+                continue
+        groups_to_compare.append((label, tuple(ids)))
+
+    labels = dict((ids, label) for label, ids in groups_to_compare)
+    completed = scheduler.run(
+        partial(compare_files_lockstep, algorithm=algorithm, chunk_size=chunk_size, drop_page_cache=drop_page_cache),
+        [ids for _, ids in groups_to_compare],
+        device_of=lambda ids: table.devs[ids[0]],
+        order_of=lambda ids: table.inodes[ids[0]],
+        cost_of=lambda ids: table.sizes[ids[0]] * len(ids),
+        arg_of=lambda ids: [table.path(file_id) for file_id in ids],
+    )
+    for ids, future in completed:
+        if cancel_event is not None and cancel_event.is_set():
+            completed.close()
+            return
+        digests = {}
+        try:
+            id_of = {table.path(file_id): file_id for file_id in ids}
+            for n, (digest, matched_paths) in enumerate(future.result(), 1):
+                digests[digest or f"{labels[ids]}:{table.sizes[ids[0]]}:{n}"] = [id_of[path] for path in matched_paths]
+                if digest:
+                    for path in matched_paths:
+                        if record is not None:
+                            record(cache_kind, id_of[path], digest)
+                        if cache is not None:
+                            cache.put(cache_kind, *table.cache_key(id_of[path]), path, digest)
+        except MemoryError:
+            raise
+        except Exception:
+            if stage is not None:
+                stage.errors += len(ids)
+        files_done += len(ids)
+        # Upper bound: files that diverge early are not read to the end.
+        bytes_compared += table.sizes[ids[0]] * len(ids)
+        if stage is not None:
+            stage.bytes_read += table.sizes[ids[0]] * len(ids)
+        if reporter is not None:
+            reporter.update(files_done, files_total, bytes_compared)
+        yield digests
+
+    if reporter is not None:
+        reporter.update(files_done, files_total, bytes_compared, force=True)
+
+def iter_duplicate_groups(folder_paths: list[str], exclude_paths: list[str] = None,
+                          cache_path: str = None, verify_cache: bool = False, prune_cache: bool = True,
+                          max_workers: int = None, hash_algorithm: str = 'sha256',
+                          confirm_with_sha256: bool = False, small_chunk_size: int = CHUNK_SIZE_SMALL,
+                          sample_stages: tuple = SAMPLE_STAGES, sample_min_size: int = SAMPLE_MIN_FILE_SIZE,
+                          chunk_size: int = CHUNK_SIZE_LARGE, drop_page_cache: bool = True,
+                          use_processes: bool = False, compare_threshold: int = COMPARE_GROUP_THRESHOLD,
+                          require_digest: bool = False, report_hardlinks: bool = False,
+                          perceptual_method: str = None, perceptual_threshold: int = PERCEPTUAL_THRESHOLD,
+                          manifest_path: str = None, shard_name: str = None, host_id: str = None,
+                          manifest_all_digests: bool = False,
+                          progress=None, cancel_event=None, stats=None):
+    """
+    Streaming version of find_duplicate_files: yields (hash, {'paths', 'size', 'algorithm', 'links'})
+    for each duplicate set as soon as its last full hash (or byte comparison) is done.
+    progress: optional callable receiving ScanProgress events (stage, files done/total, bytes hashed).
+    cancel_event: optional threading.Event; once set, the scan stops and the generator ends.
+    stats: optional ScanStats that receives one StageStats per stage as the scan runs.
+    See find_duplicate_files for the remaining options.
     """
     if exclude_paths is None:
         exclude_paths = []
+    if hash_algorithm not in HASH_ALGORITHMS:
+        raise ValueError(f"Unknown hash algorithm '{hash_algorithm}'. Available: {', '.join(HASH_ALGORITHMS)}")
+    if chunk_size <= 0 or small_chunk_size <= 0:
+        # An empty read would make every file hash like empty input and match every other one.
+        raise ValueError(f"chunk_size and small_chunk_size must be positive (got {chunk_size} and {small_chunk_size})")
+    confirm_with_sha256 = confirm_with_sha256 and hash_algorithm != 'sha256'
+
+    def cancelled():
+        return cancel_event is not None and cancel_event.is_set()
+
+    duplicate_of = {}  # representative ID -> key of the exact duplicate set it was reported in
+
+    def link_paths(ids):
+        # `ids` holds one representative per inode; expand them to every hardlinked path.
+        return [[table.path(i) for i in hardlinks.get(file_id, (file_id,))] for file_id in ids]
+
+    def external_links(ids, links):
+        # Inodes with more links than the scan found keep their data when every scanned path is deleted.
+        return {group[0]: table.nlinks[file_id] - len(group)
+                for file_id, group in zip(ids, links) if table.nlinks[file_id] > len(group)}
+
+    def duplicate_set(hash_val, ids, algorithm):
+        # Only here, for confirmed sets, are IDs turned back into path strings.
+        duplicate_of.update(dict.fromkeys(ids, hash_val))
+        links = link_paths(ids)
+        # All files in a set have the same size, and discovery already stat'ed them.
+        data = {'paths': [path for group in links for path in group], 'size': table.sizes[ids[0]],
+                'algorithm': algorithm, 'links': links}
+        outside = external_links(ids, links)
+        if outside:
+            data['external_links'] = outside
+        return data
 
     normalized_scan_paths = {os.path.abspath(os.path.normpath(p)) for p in folder_paths}
     valid_exclude_paths = [p for p in exclude_paths if os.path.abspath(os.path.normpath(p)) not in normalized_scan_paths]
@@ -48,76 +575,300 @@ def find_duplicate_files(folder_paths: list[str], exclude_paths: list[str] = Non
             unique_roots_to_scan.append(path)
             last_root = path
 
-    files_by_size = defaultdict(list)
-    all_filepaths = []
+    if stats is None:
+        stats = ScanStats()
+    # Every digest computed or taken from the cache, by cache kind, for the manifest.
+    manifest_digests = defaultdict(dict) if manifest_path else None
+    record = (lambda kind, file_id, digest: manifest_digests[kind].__setitem__(file_id, digest)) if manifest_path else None
 
-    print("Stage 0: Discovering and filtering files...")
-    for folder_path in unique_roots_to_scan:
-        for root, _, filenames in os.walk(folder_path):
-            normalized_root = os.path.abspath(os.path.normpath(root))
-            if any(normalized_root.startswith(excluded_dir) for excluded_dir in normalized_exclude_paths):
-                continue
-            for filename in filenames:
-                filepath = os.path.join(root, filename)
-                if os.path.exists(filepath) and not os.path.islink(filepath):
-                    all_filepaths.append(filepath)
-
-    print("Stage 1: Indexing files by size...")
-    with ThreadPoolExecutor() as executor:
-        future_to_path = {executor.submit(os.path.getsize, path): path for path in all_filepaths}
-        for future in as_completed(future_to_path):
-            path = future_to_path[future]
-            try:
-                size = future.result()
-                if size > 0:
-                    files_by_size[size].append(path)
-            except Exception:
-                pass
-
-    potential_duplicates_by_size = {size: paths for size, paths in files_by_size.items() if len(paths) > 1}
-
-    files_by_small_hash = defaultdict(list)
-    print("Stage 2: Performing partial hash check...")
-    paths_to_check_small_hash = [path for paths in potential_duplicates_by_size.values() for path in paths]
-
-    with ThreadPoolExecutor() as executor:
-        future_to_path = {executor.submit(get_small_hash, path): path for path in paths_to_check_small_hash}
-        for future in as_completed(future_to_path):
-            path = future_to_path[future]
-            try:
-                small_hash = future.result()
-                if small_hash: files_by_small_hash[small_hash].append(path)
-            except Exception: pass
+    print("Stage 0/1: Discovering files and indexing them by size...")
+    with stats.stage("Discovery") as stage:
+        table, potential_duplicates_by_size, hardlinks = discover_files(unique_roots_to_scan, set(normalized_exclude_paths),
+                                                                        max_workers, progress, cancel_event, stage)
+        stage.files_out = sum(len(ids) for ids in potential_duplicates_by_size)
+    if cancelled():
+        return
 
-    potential_duplicates_by_small_hash = {h: paths for h, paths in files_by_small_hash.items() if len(paths) > 1}
+    cache = HashCache(cache_path) if cache_path else None
+    scheduler = DeviceScheduler(max_workers, use_processes)
+    try:
+        print("Stage 2: Performing partial hash check...")
+        potential_duplicates_by_small_hash = []
+        with stats.stage("Partial hashing", cache) as stage:
+            stage.files_in = sum(len(ids) for ids in potential_duplicates_by_size)
+            for digests in _hash_groups(potential_duplicates_by_size,
+                                        partial(get_small_hash, algorithm=hash_algorithm, chunk_size=small_chunk_size),
+                                        cache, f"small:{hash_algorithm}:{small_chunk_size}", table, verify_cache,
+                                        scheduler, small_chunk_size, _ProgressReporter(progress, "Partial hashing"), cancel_event, stage, record):
+                potential_duplicates_by_small_hash.extend((h, ids) for h, ids in digests.items() if len(ids) > 1)
+            stage.files_out = sum(len(ids) for _, ids in potential_duplicates_by_small_hash)
+        if cancelled():
+            return
+        print(f"  Head hash: {stage.files_in} -> {stage.files_out} candidates ({stage.files_in - stage.files_out} eliminated)")
 
-    files_by_full_hash = defaultdict(list)
-    print("Stage 3: Performing full hash on remaining candidates...")
-    paths_to_check_full_hash = [path for paths in potential_duplicates_by_small_hash.values() for path in paths]
+        for samples in sample_stages:
+            groups_to_sample = [ids for _, ids in potential_duplicates_by_small_hash
+                                if table.sizes[ids[0]] >= sample_min_size]
+            if not groups_to_sample:
+                break
+            print(f"Stage 2b: Sampling head, tail and {samples} blocks of large candidates...")
+            sampled = []
+            with stats.stage(f"Sampling ({samples} blocks)", cache) as stage:
+                stage.files_in = sum(len(ids) for ids in groups_to_sample)
+                for digests in _hash_groups(groups_to_sample,
+                                            partial(get_sample_hash, algorithm=hash_algorithm, samples=samples, block_size=small_chunk_size),
+                                            cache, f"sample:{hash_algorithm}:{small_chunk_size}:{samples}", table, verify_cache,
+                                            scheduler, small_chunk_size * (samples + 2),
+                                            _ProgressReporter(progress, f"Sampling ({samples} blocks)"), cancel_event, stage, record):
+                    sampled.extend((h, ids) for h, ids in digests.items() if len(ids) > 1)
+                stage.files_out = sum(len(ids) for _, ids in sampled)
+            if cancelled():
+                return
+            print(f"  {samples}-block sample: {stage.files_in} -> {stage.files_out} candidates ({stage.files_in - stage.files_out} eliminated)")
+            potential_duplicates_by_small_hash = sampled + [
+                (h, ids) for h, ids in potential_duplicates_by_small_hash if table.sizes[ids[0]] < sample_min_size]
 
-    with ThreadPoolExecutor() as executor:
-        future_to_path = {executor.submit(get_full_hash, path): path for path in paths_to_check_full_hash}
-        for future in as_completed(future_to_path):
-            path = future_to_path[future]
-            try:
-                full_hash = future.result()
-                if full_hash: files_by_full_hash[full_hash].append(path)
-            except Exception: pass
-
-    final_duplicates_by_hash = {h: paths for h, paths in files_by_full_hash.items() if len(paths) > 1}
-
-    # --- THIS IS THE NEW PART ---
-    # Restructure the output to include the file size for each duplicate set.
-    # We already have this info from Stage 1, so it's very fast.
-    final_duplicates_with_size = {}
-    for hash_val, paths in final_duplicates_by_hash.items():
-        if paths:
-            # All files in the set have the same size, so we can just get it from the first one.
-            try:
-                size = os.path.getsize(paths[0])
-                final_duplicates_with_size[hash_val] = {'paths': paths, 'size': size}
-            except OSError:
-                continue # Skip if file has been deleted since scan started
+        final_algorithm = 'sha256' if confirm_with_sha256 else hash_algorithm
+        groups_to_compare = [(h, ids) for h, ids in potential_duplicates_by_small_hash if len(ids) <= compare_threshold]
+        groups_to_hash = [ids for _, ids in potential_duplicates_by_small_hash if len(ids) > compare_threshold]
+
+        if groups_to_compare:
+            # Byte comparison is exact, so these groups never need SHA-256 confirmation.
+            # A digest is only worth computing when it will be cached or the caller wants one.
+            # Manifests use the grouping algorithm so a merge finds the same kind of digest for every file.
+            if manifest_path:
+                digest_algorithm = hash_algorithm
+            else:
+                digest_algorithm = final_algorithm if cache is not None or require_digest else None
+            print(f"Stage 3a: Comparing {len(groups_to_compare)} small candidate groups byte by byte...")
+            with stats.stage("Byte comparison", cache) as stage:
+                stage.files_in = sum(len(ids) for _, ids in groups_to_compare)
+                for digests in _compare_groups(groups_to_compare, digest_algorithm, chunk_size, drop_page_cache, cache,
+                                               table, verify_cache, scheduler,
+                                               _ProgressReporter(progress, "Comparing"), cancel_event, stage, record):
+                    for hash_val, ids in digests.items():
+                        if len(ids) > 1:
+                            stage.files_out += len(ids)
+                            yield hash_val, duplicate_set(hash_val, ids, digest_algorithm or 'byte-compare')
+            if cancelled():
+                return
 
+        print("Stage 3b: Performing full hash on remaining candidates...")
+        def full_hash_stage(groups, algorithm, stage):
+            return _hash_groups(groups, partial(get_full_hash, algorithm=algorithm, chunk_size=chunk_size, drop_page_cache=drop_page_cache),
+                                cache, f"full:{algorithm}", table, verify_cache, scheduler,
+                                None, _ProgressReporter(progress, stage.name), cancel_event, stage, record)
+
+        def yield_final_groups(final_groups, stage):
+            for digests in final_groups:
+                for hash_val, ids in digests.items():
+                    if len(ids) > 1:
+                        stage.files_out += len(ids)
+                        yield hash_val, duplicate_set(hash_val, ids, final_algorithm)
+
+        with stats.stage("Full hashing", cache) as stage:
+            stage.files_in = sum(len(ids) for ids in groups_to_hash)
+            final_groups = full_hash_stage(groups_to_hash, hash_algorithm, stage)
+            if confirm_with_sha256:
+                groups_to_confirm = [ids for digests in final_groups for ids in digests.values() if len(ids) > 1]
+                stage.files_out = sum(len(ids) for ids in groups_to_confirm)
+            else:
+                yield from yield_final_groups(final_groups, stage)
+        if cancelled():
+            return
+        if confirm_with_sha256:
+            print(f"Stage 4: Confirming {hash_algorithm} groups with SHA-256...")
+            with stats.stage("Confirming with SHA-256", cache) as stage:
+                stage.files_in = sum(len(ids) for ids in groups_to_confirm)
+                yield from yield_final_groups(full_hash_stage(groups_to_confirm, final_algorithm, stage), stage)
+            if cancelled():
+                return
+
+        if perceptual_method:
+            print(f"Stage 5: Matching similar images ({perceptual_method})...")
+            with stats.stage(f"Perceptual matching ({perceptual_method})") as stage:
+                linked_copies = {file_id for ids in hardlinks.values() for file_id in ids[1:]}
+                image_ids = [file_id for file_id in range(len(table))
+                             if file_id not in linked_copies and table.name(file_id).lower().endswith(IMAGE_EXTENSIONS)]
+                id_of = {table.path(file_id): file_id for file_id in image_ids}
+                stage.files_in = len(id_of)
+                stage.bytes_read = sum(table.sizes[file_id] for file_id in image_ids)  # Upper bound: JPEGs decode in draft mode
+                reporter = _ProgressReporter(progress, f"Perceptual hashing ({perceptual_method})")
+                similar_groups = find_similar_images(
+                    list(id_of), perceptual_method, perceptual_threshold, max_workers,
+                    progress=lambda done, total: reporter.update(done, total, 0), cancel_event=cancel_event)
+                if cancelled():
+                    return
+                for phash_val, paths in similar_groups:
+                    ids = [id_of[path] for path in paths]
+                    # A group that is entirely one byte-identical set has been reported already.
+                    if ids[0] in duplicate_of and len({duplicate_of.get(file_id) for file_id in ids}) == 1:
+                        continue
+                    stage.files_out += len(ids)
+                    links = link_paths(ids)
+                    data = {'paths': [path for group in links for path in group],
+                            'size': max(table.sizes[file_id] for file_id in ids),
+                            'sizes': {path: table.sizes[file_id] for file_id, group in zip(ids, links) for path in group},
+                            'algorithm': perceptual_method, 'links': links, 'similar': True}
+                    outside = external_links(ids, links)
+                    if outside:
+                        data['external_links'] = outside
+                    yield f"{perceptual_method}:{phash_val}", data
+
+        if report_hardlinks:
+            # Inodes reachable through several paths but without a content duplicate elsewhere.
+            for representative, ids in hardlinks.items():
+                if representative not in duplicate_of:
+                    paths = [table.path(file_id) for file_id in ids]
+                    yield f"inode:{table.devs[representative]}:{table.inodes[representative]}", {
+                        'paths': paths, 'size': table.sizes[representative], 'algorithm': 'hardlink', 'links': [paths]}
+
+        if manifest_path and manifest_all_digests:
+            # Another shard may hold a copy of any file, so give the merge a digest for each one.
+            print("Stage 6: Hashing the remaining files for the manifest...")
+            linked_copies = {file_id for ids in hardlinks.values() for file_id in ids[1:]}
+            with stats.stage("Manifest digests", cache) as stage:
+                for kind, hash_func, read_size in (
+                        (f"small:{hash_algorithm}:{small_chunk_size}",
+                         partial(get_small_hash, algorithm=hash_algorithm, chunk_size=small_chunk_size), small_chunk_size),
+                        (f"full:{hash_algorithm}",
+                         partial(get_full_hash, algorithm=hash_algorithm, chunk_size=chunk_size, drop_page_cache=drop_page_cache), None)):
+                    missing = [file_id for file_id in range(len(table))
+                               if file_id not in linked_copies and file_id not in manifest_digests[kind]]
+                    stage.files_in += len(missing)
+                    for _ in _hash_groups([missing], hash_func, cache, kind, table, verify_cache, scheduler, read_size,
+                                          _ProgressReporter(progress, stage.name), cancel_event, stage, record):
+                        pass
+                stage.files_out = stage.files_in - stage.errors
+            if cancelled():
+                return
+
+        if cache is not None:
+            if prune_cache:
+                # Only candidates can have been hashed by this scan; other cached files are checked with a stat.
+                seen_inodes = {(table.devs[file_id], table.inodes[file_id])
+                               for ids in potential_duplicates_by_size for file_id in ids}
+                pruned = cache.prune(unique_roots_to_scan, seen_inodes)
+                print(f"Hash cache: {cache.hits} hits, {cache.misses} misses, {pruned} stale entries pruned.")
+            else:
+                print(f"Hash cache: {cache.hits} hits, {cache.misses} misses.")
+
+        if manifest_path:
+            write_manifest(manifest_path, table, hardlinks, manifest_digests,
+                           shard=shard_name or platform.node(), host_id=host_id, roots=unique_roots_to_scan,
+                           hash_algorithm=hash_algorithm, confirm_with_sha256=confirm_with_sha256,
+                           small_chunk_size=small_chunk_size)
+            print(f"Manifest written to {manifest_path} ({len(table)} files, {sum(map(len, manifest_digests.values()))} digests).")
+
+        peak_rss = peak_rss_bytes()
+        if peak_rss is not None:
+            print(f"Indexed {len(table)} files in {len(table.dirs)} folders; peak memory (RSS): {peak_rss / (1024 * 1024):.1f} MB")
+    finally:
+        scheduler.close()
+        if cache is not None:
+            cache.close()
+
+def find_duplicate_files(folder_paths: list[str], exclude_paths: list[str] = None, **scan_options) -> dict:
+    """
+    Finds duplicate files in the given folders, respecting an exclusion list.
+    NOW RETURNS: {hash: {'paths': [path1, path2], 'size': file_size_in_bytes, 'algorithm': name, 'links': [[path1], [path2]]}}
+    where 'algorithm' names the hash that produced the key and 'links' groups the paths
+    by inode: paths in the same inner list are hardlinks, so deleting only some of them
+    frees no space. Each inode is read once however many links it has.
+    Sets where some inode also has hardlinks outside the scanned folders carry
+    'external_links': {first path of that inode: number of such links}; deleting
+    the scanned paths of those inodes frees nothing either.
+
+    scan_options (all optional, passed on to iter_duplicate_groups):
+    cache_path: SQLite hash cache to consult before reading any file (None disables it).
+    verify_cache: re-hash cached files and fix stale entries instead of trusting the cache.
+    prune_cache: drop cache entries for files under the scanned folders that no longer exist.
+    max_workers: thread count for directory discovery and upper bound on concurrent hashing
+        (None uses the ThreadPoolExecutor / DeviceScheduler defaults).
+    hash_algorithm: any key of HASH_ALGORITHMS, used for grouping in Stages 2 and 3.
+    confirm_with_sha256: re-hash only the final groups with SHA-256 and key them by that digest,
+        so a fast (e.g. non-cryptographic) grouping hash never decides what gets deleted on its own.
+    small_chunk_size: bytes read from the start of each file for the Stage 2 partial hash,
+        and the block size of the sampled fingerprint stages.
+    sample_stages: sample counts of the fingerprint stages run after the head hash on files of at
+        least sample_min_size bytes (head + tail + N evenly spaced blocks; () disables them).
+    chunk_size: read buffer size for full hashing (one buffer per worker thread).
+    drop_page_cache: advise the kernel to drop fully hashed files from the page cache.
+    use_processes: hash in a process pool instead of threads (helps when hashing is CPU bound).
+    compare_threshold: candidate groups of at most this many files are compared byte by byte
+        in lockstep, stopping at the first difference, instead of being fully hashed (0 disables).
+    require_digest: compute a content digest for compared groups even without a cache;
+        otherwise their keys are '<partial hash>:<size>:<n>' and 'algorithm' is 'byte-compare'.
+    perceptual_method: 'dhash' or 'phash' to also group visually similar images (IMAGE_EXTENSIONS)
+        that are not byte-identical; needs Pillow and NumPy. These sets are keyed '<method>:<hash>',
+        carry 'similar': True and per-path 'sizes', and 'size' is their largest file.
+    perceptual_threshold: maximum Hamming distance (of 64 bits) between similar images.
+    report_hardlinks: also return inodes with several paths but no content duplicate, keyed
+        'inode:<dev>:<ino>' with algorithm 'hardlink'.
+    manifest_path: once the scan completes, write every indexed file and every digest computed
+        to this manifest file, for merging shards with merge_manifests (see the _manifest module).
+    shard_name: name stored in the manifest to tell shards apart (default: this host's name).
+    manifest_all_digests: also write partial and full digests of files that had no candidate in this
+        scan, so a merge can match them against other shards without reaching the files.
+    host_id: identity of the machine whose st_dev/st_ino the manifest records; a merge treats files
+        with the same host_id, st_dev and st_ino as one inode (default: default_host_id()).
+    progress, cancel_event, stats: see iter_duplicate_groups.
+    """
+    final_duplicates_with_size = dict(iter_duplicate_groups(folder_paths, exclude_paths, **scan_options))
     print(f"Scan complete. Found {len(final_duplicates_with_size)} sets of duplicates.")
-    return final_duplicates_with_size
\ No newline at end of file
+    return final_duplicates_with_size
+
+class ScanWorker:
+    """
+    Runs iter_duplicate_groups on a background thread so a UI can poll it.
+    `duplicates` fills up while the scan runs; read it through snapshot().
+    `stats` is the ScanStats of the scan, filled in stage by stage.
+    """
+
+    def __init__(self, folder_paths, exclude_paths=None, **scan_options):
+        self.progress = None
+        self.error = None
+        self.started_at = None
+        self.finished_at = None
+        self.stats = scan_options.pop('stats', None) or ScanStats()
+        self._duplicates = {}
+        self._lock = threading.Lock()
+        self._cancel_event = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, args=(folder_paths, exclude_paths, scan_options), daemon=True)
+
+    def _run(self, folder_paths, exclude_paths, scan_options):
+        try:
+            groups = iter_duplicate_groups(folder_paths, exclude_paths, progress=self._on_progress,
+                                           cancel_event=self._cancel_event, stats=self.stats, **scan_options)
+            for hash_val, data in groups:
+                with self._lock:
+                    self._duplicates[hash_val] = data
+        except Exception as e:
+            self.error = e
+        finally:
+            self.finished_at = time.time()
+
+    def _on_progress(self, event):
+        self.progress = event
+
+    def start(self):
+        self.started_at = time.time()
+        self._thread.start()
+        return self
+
+    def cancel(self):
+        self._cancel_event.set()
+
+    @property
+    def cancelled(self):
+        return self._cancel_event.is_set()
+
+    @property
+    def is_running(self):
+        return self._thread.is_alive()
+
+    def snapshot(self) -> dict:
+        """Copy of the duplicate sets found so far."""
+        with self._lock:
+            return dict(self._duplicates)
@@ -0,0 +1,362 @@
+# _1streamlit_duplicate_finder_manifest.py
+
+"""
+Scan manifests for sharded and cross-host duplicate searches.
+
+A scan can write every file it indexed (path, size, st_dev, st_ino, mtime, nlink) and
+every digest it computed on the way (partial, sampled and full hashes) to a
+manifest: a zip file of typed array columns plus a small JSON header. Each
+host or volume is scanned on its own, in parallel, and the manifests are then
+merged without rescanning: files are matched across shards by size, then by
+the digests the shards already have. A file is only read again when the
+shards disagree on what was hashed (e.g. its size was unique in its own shard),
+and only if the merging host can reach it unchanged.
+
+Every manifest records the host it was scanned on (host_id, separate from the
+overridable shard name). Shards from the same host can overlap (overlapping
+roots, or one volume scanned as several shards), so their files are matched by
+(host_id, st_dev, st_ino) and one file seen twice is reported as a single inode.
+"""
+
+import json
+import os
+import platform
+import sys
+import time
+import uuid
+import zipfile
+from array import array
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from _1streamlit_duplicate_finder_filetable import FileTable
+from _1streamlit_duplicate_finder_stats import ScanStats
+
+MANIFEST_VERSION = 2
+
+# Column name -> array typecode; stored little-endian.
+_TABLE_COLUMNS = {'dir_ids': 'I', 'name_ends': 'Q', 'sizes': 'Q', 'devs': 'Q', 'inodes': 'Q', 'mtimes_ns': 'q', 'nlinks': 'I'}
+
+
+def _array_bytes(values):
+    if sys.byteorder == 'big':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _bytes_array(typecode, data):
+    values = array(typecode)
+    values.frombytes(data)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+
+def default_host_id():
+    """
+    Identifies the machine whose st_dev/st_ino numbers a manifest uses: host name plus
+    the systemd/D-Bus machine ID, or the MAC-based node ID where there is none.
+    """
+    for machine_id_path in ('/etc/machine-id', '/var/lib/dbus/machine-id'):
+        try:
+            with open(machine_id_path) as f:
+                machine_id = f.read().strip()
+        except OSError:
+            continue
+        if machine_id:
+            return f"{platform.node()}/{machine_id}"
+    return f"{platform.node()}/{uuid.getnode():012x}"
+
+
+def write_manifest(path, table, hardlinks, digests, **meta):
+    """
+    Writes a manifest for one shard.
+    table: the scan's FileTable; hardlinks: {representative ID: [IDs]};
+    digests: {cache kind, e.g. 'full:sha256': {file ID: hex digest}};
+    meta: extra header fields (shard name, roots, hash_algorithm, small_chunk_size, ...);
+    host_id defaults to default_host_id().
+    The file is written to a temporary name and renamed, so a reader never sees half a manifest.
+    """
+    header = dict(meta, host_id=meta.get('host_id') or default_host_id(), version=MANIFEST_VERSION, created=time.strftime("%Y-%m-%dT%H:%M:%S"),
+                  files=len(table), digest_kinds=list(digests))
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with zipfile.ZipFile(tmp_path, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr('manifest.json', json.dumps(header, indent=2))
+        for name, values in table.columns().items():
+            zf.writestr(f"table/{name}", values if isinstance(values, bytes) else _array_bytes(values))
+        # One (representative, linked copy) pair per extra path of a hardlinked inode.
+        representatives = array('I', (ids[0] for ids in hardlinks.values() for _ in ids[1:]))
+        links = array('I', (file_id for ids in hardlinks.values() for file_id in ids[1:]))
+        zf.writestr("hardlinks/representatives", _array_bytes(representatives))
+        zf.writestr("hardlinks/links", _array_bytes(links))
+        for index, by_id in enumerate(digests.values()):
+            # Hex digests are stored as fixed-width raw bytes next to a file ID column.
+            ids = array('I', by_id)
+            zf.writestr(f"digests/{index}/ids", _array_bytes(ids))
+            zf.writestr(f"digests/{index}/values", b''.join(bytes.fromhex(digest) for digest in by_id.values()))
+    os.replace(tmp_path, path)
+
+
+class Manifest:
+    """A loaded shard manifest: .meta, .host_id, .table (FileTable), .hardlinks and .digests like write_manifest's."""
+
+    def __init__(self, path):
+        self.path = path
+        try:
+            self._load(path)
+        except (zipfile.BadZipFile, KeyError) as e:
+            raise ValueError(f"{path}: not a valid manifest ({e})")
+        self.name = self.meta.get('shard') or os.path.splitext(os.path.basename(path))[0]
+
+    def _load(self, path):
+        with zipfile.ZipFile(path) as zf:
+            self.meta = json.loads(zf.read('manifest.json'))
+            if self.meta.get('version') != MANIFEST_VERSION:
+                raise ValueError(f"{path}: unsupported manifest version {self.meta.get('version')}")
+            self.host_id = self.meta['host_id']
+            columns = {name: _bytes_array(typecode, zf.read(f"table/{name}")) for name, typecode in _TABLE_COLUMNS.items()}
+            columns['dirs'] = zf.read("table/dirs")
+            columns['names'] = zf.read("table/names")
+            self.table = FileTable.from_columns(columns)
+            self.hardlinks = {}
+            representatives = _bytes_array('I', zf.read("hardlinks/representatives"))
+            for representative, file_id in zip(representatives, _bytes_array('I', zf.read("hardlinks/links"))):
+                self.hardlinks.setdefault(representative, [representative]).append(file_id)
+            self.digests = {}
+            for index, kind in enumerate(self.meta['digest_kinds']):
+                ids = _bytes_array('I', zf.read(f"digests/{index}/ids"))
+                values = zf.read(f"digests/{index}/values")
+                width = len(values) // len(ids) if ids else 0
+                self.digests[kind] = {file_id: values[i * width:(i + 1) * width].hex() for i, file_id in enumerate(ids)}
+
+    def indexed_ids(self):
+        """IDs of the files that stand for their inode (hardlinked copies are left out)."""
+        linked_copies = {file_id for ids in self.hardlinks.values() for file_id in ids[1:]}
+        return (file_id for file_id in range(len(self.table)) if file_id not in linked_copies)
+
+
+def _lazy_hash(hash_func, manifest, file_id):
+    """Hashes a file named in a manifest if this host sees it unchanged (same size and mtime); else None."""
+    path = manifest.table.path(file_id)
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    if (st.st_size, st.st_mtime_ns) != (manifest.table.sizes[file_id], manifest.table.mtimes_ns[file_id]):
+        return None
+    return hash_func(path)
+
+
+def iter_merged_duplicate_groups(manifest_paths, hash_algorithm=None, confirm_with_sha256=None, lazy_hash=True,
+                                 max_workers=None, stats=None):
+    """
+    Finds duplicates across shard manifests and yields (hash, {'paths', 'size', 'algorithm',
+    'links', 'shards'}) per set, 'shards' naming the shard of each path. A file listed by several
+    shards of one host (same st_dev and st_ino) is one inode: its paths form a single 'links' group.
+    Files are grouped by size, then by partial, sampled and full digests taken from the manifests.
+    With confirm_with_sha256 (default: if any shard was scanned with it), the final groups are
+    split once more by SHA-256, so a non-cryptographic grouping hash never decides a set alone.
+    Where a shard has no digest for a file, it is hashed here (lazy_hash) if the path is
+    reachable and unchanged. Candidates that still have no digest are counted as errors in
+    stats and, after the duplicate sets, yielded as ('unresolved:<n>', {... 'algorithm':
+    'unresolved', 'unresolved': [paths]}) together with the files they might duplicate.
+    Scanning with manifest_all_digests avoids them.
+    """
+    # Imported here because the logic module imports this one to write manifests.
+    from _1streamlit_duplicate_finder_logic import get_small_hash, get_sample_hash, get_full_hash, CHUNK_SIZE_SMALL
+
+    if stats is None:
+        stats = ScanStats()
+    manifests = [Manifest(path) for path in manifest_paths]
+    if not manifests:
+        return
+    algorithm = hash_algorithm or manifests[0].meta.get('hash_algorithm', 'sha256')
+    small_chunk_size = manifests[0].meta.get('small_chunk_size', CHUNK_SIZE_SMALL)
+    small_kind, full_kind = f"small:{algorithm}:{small_chunk_size}", f"full:{algorithm}"
+    if confirm_with_sha256 is None:
+        confirm_with_sha256 = any(manifest.meta.get('confirm_with_sha256') for manifest in manifests)
+    confirm_with_sha256 = confirm_with_sha256 and algorithm != 'sha256'
+
+    # Only shards sharing a host can list the same inode twice; their files are matched by identity.
+    shards_per_host = defaultdict(int)
+    for manifest in manifests:
+        shards_per_host[manifest.host_id] += 1
+    same_inode = defaultdict(list)  # (shard, file ID) standing for an inode -> the same inode in later shards
+
+    with stats.stage("Merge: grouping by size") as stage:
+        first_of_size, members_by_size, first_of_inode = {}, {}, {}
+        for shard, manifest in enumerate(manifests):
+            shared_host = shards_per_host[manifest.host_id] > 1
+            for file_id in manifest.indexed_ids():
+                stage.files_in += 1
+                if shared_host:
+                    inode = (manifest.host_id, manifest.table.devs[file_id], manifest.table.inodes[file_id])
+                    first = first_of_inode.setdefault(inode, (shard, file_id))
+                    if first != (shard, file_id):
+                        same_inode[first].append((shard, file_id))
+                        continue
+                size = manifest.table.sizes[file_id]
+                other = first_of_size.setdefault(size, (shard, file_id))
+                if other != (shard, file_id):
+                    members_by_size.setdefault(size, [other]).append((shard, file_id))
+        del first_of_size, first_of_inode
+        groups = list(members_by_size.values())
+        stage.files_out = sum(len(group) for group in groups)
+
+    def known_digest(member, kind):
+        # Any shard that listed the inode may have hashed it.
+        for shard, file_id in (member, *same_inode.get(member, ())):
+            digest = manifests[shard].digests.get(kind, {}).get(file_id)
+            if digest is not None:
+                return digest
+        return None
+
+    unresolved = []  # (candidate group, its members without a digest)
+
+    def split(groups, kind, hash_func, read_size, stage):
+        """Splits each group by its `kind` digest, hashing lazily where a manifest has none."""
+        missing = [member for group in groups for member in group if known_digest(member, kind) is None]
+        computed = {}
+        if missing and lazy_hash:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                digests = executor.map(lambda member: _lazy_hash(hash_func, manifests[member[0]], member[1]), missing)
+                computed = dict(zip(missing, digests))
+            stage.bytes_read += sum(min(manifests[shard].table.sizes[file_id], read_size or sys.maxsize)
+                                    for (shard, file_id), digest in computed.items() if digest is not None)
+        result = []
+        for group in groups:
+            stage.files_in += len(group)
+            by_digest = defaultdict(list)
+            group_missing = []
+            for shard, file_id in group:
+                digest = known_digest((shard, file_id), kind) or computed.get((shard, file_id))
+                if digest is None:
+                    stage.errors += 1  # Not hashed in its shard and not reachable from here
+                    group_missing.append((shard, file_id))
+                else:
+                    by_digest[digest].append((shard, file_id))
+            if group_missing:
+                unresolved.append((group, group_missing))
+            result.extend((digest, members) for digest, members in by_digest.items() if len(members) > 1)
+        stage.files_out = sum(len(members) for _, members in result)
+        return result
+
+    sample_prefix = f"sample:{algorithm}:{small_chunk_size}:"
+
+    def split_by_samples(groups, stage):
+        """
+        Splits groups by the sampled digest kinds their shards recorded. Members without one are
+        sampled here (lazy_hash) if reachable; a group with a member still missing a digest of a
+        kind is left whole for the full step, so sampling never makes a candidate unresolved.
+        """
+        kinds = sorted({kind for shard, _ in (member for group in groups for member in group)
+                        for kind in manifests[shard].digests if kind.startswith(sample_prefix)})
+        stage.files_in = sum(len(group) for group in groups)
+        for kind in kinds:
+            missing = [member for group in groups for member in group if known_digest(member, kind) is None]
+            computed = {}
+            if missing and lazy_hash:
+                hash_func = partial(get_sample_hash, algorithm=algorithm, samples=int(kind[len(sample_prefix):]),
+                                    block_size=small_chunk_size)
+                with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                    computed = dict(zip(missing, executor.map(
+                        lambda member: _lazy_hash(hash_func, manifests[member[0]], member[1]), missing)))
+                read_size = small_chunk_size * (hash_func.keywords['samples'] + 2)
+                stage.bytes_read += sum(min(manifests[shard].table.sizes[file_id], read_size)
+                                        for (shard, file_id), digest in computed.items() if digest is not None)
+            next_groups = []
+            for group in groups:
+                digests = [known_digest(member, kind) or computed.get(member) for member in group]
+                if None in digests:
+                    next_groups.append(group)
+                    continue
+                by_digest = defaultdict(list)
+                for member, digest in zip(group, digests):
+                    by_digest[digest].append(member)
+                next_groups.extend(members for members in by_digest.values() if len(members) > 1)
+            groups = next_groups
+        stage.files_out = sum(len(group) for group in groups)
+        return groups
+
+    def disjoint(unresolved):
+        """Merges unresolved groups that share a member, so every candidate is reported in one group."""
+        parent = {}
+
+        def find(member):
+            while parent[member] != member:
+                parent[member] = parent[parent[member]]
+                member = parent[member]
+            return member
+
+        for members, _ in unresolved:
+            for member in members:
+                parent.setdefault(member, member)
+                parent[find(member)] = find(members[0])
+        merged = {}
+        for members, missing in unresolved:
+            entry = merged.setdefault(find(members[0]), ({}, {}))
+            entry[0].update(dict.fromkeys(members))
+            entry[1].update(dict.fromkeys(missing))
+        return [(list(members), list(missing)) for members, missing in merged.values()]
+
+    # A group whose members all have a full digest needs no partial step.
+    has_full = lambda member: known_digest(member, full_kind) is not None
+    complete = [group for group in groups if all(map(has_full, group))]
+    incomplete = [group for group in groups if not all(map(has_full, group))]
+    with stats.stage("Merge: partial hashes") as stage:
+        partial_groups = split(incomplete, small_kind, partial(get_small_hash, algorithm=algorithm, chunk_size=small_chunk_size),
+                               small_chunk_size, stage)
+    with stats.stage("Merge: sampled digests") as stage:
+        sampled_groups = split_by_samples([members for _, members in partial_groups], stage)
+    with stats.stage("Merge: full hashes") as stage:
+        final_groups = split(complete + sampled_groups, full_kind,
+                             partial(get_full_hash, algorithm=algorithm), None, stage)
+    final_algorithm = 'sha256' if confirm_with_sha256 else algorithm
+    if confirm_with_sha256:
+        with stats.stage("Merge: confirming with SHA-256") as stage:
+            final_groups = split([members for _, members in final_groups], "full:sha256",
+                                 partial(get_full_hash, algorithm='sha256'), None, stage)
+
+    def inode_paths(member):
+        """(path, shard name) of every link of a member's inode, over all shards that listed it."""
+        seen = {}
+        for shard, file_id in (member, *same_inode.get(member, ())):
+            manifest = manifests[shard]
+            for i in manifest.hardlinks.get(file_id, (file_id,)):
+                seen.setdefault(manifest.table.path(i), manifest.name)  # Overlapping roots list a path twice
+        return list(seen.items())
+
+    def merged_set(members, set_algorithm):
+        links, shards, outside = [], [], {}
+        for member in members:
+            group = inode_paths(member)
+            links.append([path for path, _ in group])
+            shards.extend(name for _, name in group)
+            shard, file_id = member
+            if manifests[shard].table.nlinks[file_id] > len(group):
+                outside[group[0][0]] = manifests[shard].table.nlinks[file_id] - len(group)
+        shard, file_id = members[0]
+        data = {'paths': [path for group in links for path in group], 'size': manifests[shard].table.sizes[file_id],
+                'algorithm': set_algorithm, 'links': links, 'shards': shards}
+        if outside:
+            data['external_links'] = outside
+        return data
+
+    for digest, members in final_groups:
+        yield digest, merged_set(members, final_algorithm)
+    # Not duplicates, only files that could not be ruled in or out from here.
+    for n, (members, missing) in enumerate(disjoint(unresolved), 1):
+        data = merged_set(members, 'unresolved')
+        data['unresolved'] = [path for member in missing for path, _ in inode_paths(member)]
+        yield f"unresolved:{n}", data
+
+
+def merge_manifests(manifest_paths, **merge_options) -> dict:
+    """Non-streaming iter_merged_duplicate_groups: {hash: set} for all shards."""
+    merged = dict(iter_merged_duplicate_groups(manifest_paths, **merge_options))
+    unresolved = sum(data['algorithm'] == 'unresolved' for data in merged.values())
+    print(f"Merge complete. Found {len(merged) - unresolved} sets of duplicates across {len(manifest_paths)} manifests"
+          + (f", {unresolved} groups with unresolved candidates." if unresolved else "."))
+    return merged
@@ -0,0 +1,158 @@
+# _1streamlit_duplicate_finder_perceptual.py
+
+"""
+Perceptual near-duplicate detection for images.
+
+Exact hashing only matches byte-identical files; a resized, re-encoded or
+EXIF-stripped copy of a photo has different bytes but nearly the same picture.
+Each image gets a 64-bit perceptual hash (dHash or pHash), decoded in a process
+pool, and hashes within a Hamming distance threshold are grouped.
+Candidate pairs come from a multi-index: the 64 bits are cut into threshold + 1
+chunks, and by the pigeonhole principle two hashes within the threshold agree
+exactly on at least one chunk, so only hashes sharing a chunk value are compared
+(vectorized with NumPy) instead of all n² pairs.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+# --- Graceful Library Imports (Pillow and NumPy are optional for the exact scan) ---
+try:
+    from PIL import Image, ImageOps
+    PIL_AVAILABLE = True
+except ImportError:
+    PIL_AVAILABLE = False
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+PERCEPTUAL_AVAILABLE = PIL_AVAILABLE and NUMPY_AVAILABLE
+
+PERCEPTUAL_METHODS = ('dhash', 'phash')
+# Default maximum Hamming distance (out of 64 bits) for two images to count as similar.
+PERCEPTUAL_THRESHOLD = 6
+# Images handed to each worker process per task.
+DECODE_CHUNK_SIZE = 32
+
+if NUMPY_AVAILABLE:
+    _POPCOUNT_TABLE = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def _load_grayscale(path, size):
+    with Image.open(path) as img:
+        # For JPEGs, draft() lets the decoder downscale while decoding, which is far cheaper.
+        img.draft('L', (size[0] * 4, size[1] * 4))
+        img = ImageOps.exif_transpose(img)
+        return np.asarray(img.convert('L').resize(size, Image.Resampling.LANCZOS), dtype=np.float32)
+
+
+def _bits_to_int(bits):
+    return int.from_bytes(np.packbits(bits.ravel()).tobytes(), 'big')
+
+
+def dhash(path):
+    """Difference hash: whether each pixel of a 9x8 thumbnail is brighter than its left neighbour."""
+    pixels = _load_grayscale(path, (9, 8))
+    return _bits_to_int(pixels[:, 1:] > pixels[:, :-1])
+
+
+_DCT_MATRIX = None
+
+def phash(path):
+    """DCT hash: low 8x8 frequencies of a 32x32 thumbnail compared to their median."""
+    global _DCT_MATRIX
+    if _DCT_MATRIX is None:
+        n = 32
+        k = np.arange(n)
+        _DCT_MATRIX = np.cos(np.pi * (2 * k[None, :] + 1) * k[:, None] / (2 * n)).astype(np.float32)
+    pixels = _load_grayscale(path, (32, 32))
+    low = (_DCT_MATRIX @ pixels @ _DCT_MATRIX.T)[:8, :8]
+    # The DC term only reflects overall brightness and would dominate the median.
+    return _bits_to_int(low > np.median(low.ravel()[1:]))
+
+
+_METHODS = {'dhash': dhash, 'phash': phash}
+
+def compute_perceptual_hash(path, method='dhash'):
+    """Returns the 64-bit perceptual hash of an image, or None if it can't be decoded."""
+    try:
+        return _METHODS[method](path)
+    except Exception:
+        return None
+
+
+def _popcount(values):
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(values)
+    return _POPCOUNT_TABLE[values.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+
+def group_similar_hashes(hashes, threshold=PERCEPTUAL_THRESHOLD):
+    """
+    Groups indices of `hashes` (np.uint64 array) connected by Hamming distance <= threshold.
+    Returns lists of indices with at least two members.
+    """
+    n = len(hashes)
+    parent = list(range(n))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    chunks = min(threshold + 1, 64)
+    bounds = [64 * i // chunks for i in range(chunks + 1)]
+    for lo, hi in zip(bounds, bounds[1:]):
+        keys = (hashes >> np.uint64(lo)) & np.uint64((1 << (hi - lo)) - 1)
+        order = np.argsort(keys, kind='stable')
+        for bucket in np.split(order, np.flatnonzero(np.diff(keys[order])) + 1):
+            if len(bucket) < 2:
+                continue
+            bucket_hashes = hashes[bucket]
+            for j in range(len(bucket) - 1):
+                distances = _popcount(bucket_hashes[j + 1:] ^ bucket_hashes[j])
+                root_j = find(bucket[j])
+                for k in np.flatnonzero(distances <= threshold):
+                    root_k = find(bucket[j + 1 + k])
+                    if root_k != root_j:
+                        parent[root_k] = root_j
+
+    groups = {}
+    for i in range(n):
+        groups.setdefault(find(i), []).append(i)
+    return [members for members in groups.values() if len(members) > 1]
+
+
+def find_similar_images(paths, method='dhash', threshold=PERCEPTUAL_THRESHOLD, max_workers=None,
+                        progress=None, cancel_event=None):
+    """
+    Perceptually hashes `paths` in a process pool and returns [(hash, [paths]), ...]
+    for every group of near-identical images; `hash` is the first member's hash.
+    progress, if given, is called with (images done, images total).
+    Returns what was grouped so far once cancel_event is set.
+    """
+    if not PERCEPTUAL_AVAILABLE:
+        raise RuntimeError("Perceptual image matching needs Pillow and NumPy (pip install Pillow numpy).")
+    if method not in _METHODS:
+        raise ValueError(f"Unknown perceptual method '{method}'. Available: {', '.join(PERCEPTUAL_METHODS)}")
+
+    hashed_paths, hash_values = [], []
+    with ProcessPoolExecutor(max_workers=max_workers or os.cpu_count()) as executor:
+        results = executor.map(compute_perceptual_hash, paths, [method] * len(paths), chunksize=DECODE_CHUNK_SIZE)
+        for done, (path, value) in enumerate(zip(paths, results), 1):
+            if value is not None:
+                hashed_paths.append(path)
+                hash_values.append(value)
+            if progress is not None:
+                progress(done, len(paths))
+            if cancel_event is not None and cancel_event.is_set():
+                executor.shutdown(wait=False, cancel_futures=True)
+                break
+
+    hashes = np.array(hash_values, dtype=np.uint64)
+    return [(f"{hash_values[members[0]]:016x}", [hashed_paths[i] for i in members])
+            for members in group_similar_hashes(hashes, threshold)]
@@ -0,0 +1,158 @@
+# _1streamlit_duplicate_finder_scheduler.py
+
+"""
+Device-aware I/O scheduler for the hashing stages.
+
+Work is queued per st_dev and each device gets its own concurrency limit:
+spinning disks start low so reads don't turn into a seek storm, SSD/NVMe start
+high, and every limit is then tuned at runtime by hill-climbing on the MB/s
+measured for that device. Within a device, reads are issued in inode order,
+which roughly follows on-disk layout on most filesystems.
+"""
+
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+# Starting (and maximum) concurrent reads per device type.
+ROTATIONAL_LIMITS = (1, 4)
+SOLID_STATE_LIMITS = (8, 64)
+UNKNOWN_DEVICE_LIMITS = (4, 32)  # network shares, FUSE, overlay filesystems, ...
+
+# How often (seconds) each device's limit is re-evaluated, and the throughput
+# drop that makes the hill-climb reverse direction.
+ADAPT_INTERVAL = 0.5
+ADAPT_TOLERANCE = 0.95
+
+
+def is_rotational(dev):
+    """True/False for a local block device on Linux, None when it can't be determined."""
+    try:
+        sys_path = os.path.realpath(f"/sys/dev/block/{os.major(dev)}:{os.minor(dev)}")
+    except (AttributeError, ValueError, OSError):
+        return None
+    # Partitions have no queue/ directory of their own; it lives on the parent disk.
+    for candidate in (sys_path, os.path.dirname(sys_path)):
+        try:
+            with open(os.path.join(candidate, "queue", "rotational")) as f:
+                return f.read().strip() == "1"
+        except OSError:
+            continue
+    return None
+
+
+class _DeviceState:
+    def __init__(self, dev, max_workers):
+        rotational = is_rotational(dev)
+        if rotational is None:
+            initial, maximum = UNKNOWN_DEVICE_LIMITS
+        else:
+            initial, maximum = ROTATIONAL_LIMITS if rotational else SOLID_STATE_LIMITS
+        self.max_limit = max(1, min(maximum, max_workers))
+        self.limit = min(initial, self.max_limit)
+        self.queue = deque()
+        self.inflight = 0
+        self.direction = 1
+        self.last_rate = None
+        self.window_bytes = 0
+        self.window_start = time.monotonic()
+
+    def record(self, nbytes):
+        """Accumulates completed bytes and periodically moves the limit one step up or down."""
+        self.window_bytes += nbytes
+        now = time.monotonic()
+        elapsed = now - self.window_start
+        if elapsed < ADAPT_INTERVAL:
+            return
+        rate = self.window_bytes / elapsed
+        # Only judge a limit that was actually saturated; otherwise the queue, not the disk, set the rate.
+        if self.queue:
+            if self.last_rate is not None and rate < self.last_rate * ADAPT_TOLERANCE:
+                self.direction = -self.direction
+            self.limit = max(1, min(self.max_limit, self.limit + self.direction))
+            self.last_rate = rate
+        self.window_bytes = 0
+        self.window_start = now
+
+
+class DeviceScheduler:
+    """
+    Runs a function over many files, limiting concurrent work per device.
+    One scheduler is meant to be shared by all hashing stages of a scan so
+    the tuned limits carry over from one stage to the next.
+    """
+
+    def __init__(self, max_workers=None, use_processes=False):
+        if max_workers is None:
+            max_workers = min(64, (os.cpu_count() or 1) * 4)
+        self.max_workers = max_workers
+        if use_processes:
+            # Hashing is CPU bound once data is cached; the GIL is released by hashlib
+            # only for larger updates, so a process pool can still help on many small files.
+            self.executor = ProcessPoolExecutor(max_workers=min(max_workers, os.cpu_count() or 1))
+        else:
+            self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.devices = {}
+
+    def _device(self, dev):
+        state = self.devices.get(dev)
+        if state is None:
+            state = self.devices[dev] = _DeviceState(dev, self.max_workers)
+        return state
+
+    def run(self, func, items, device_of, order_of=None, cost_of=None, arg_of=None):
+        """
+        Calls func(item) for every item and yields (item, future) as each one finishes.
+        device_of(item) gives the st_dev to queue it on, order_of(item) the read order
+        within that device and cost_of(item) the bytes it reads (for the MB/s estimate).
+        With arg_of, func is called with arg_of(item) instead, evaluated only when the
+        call is submitted (e.g. to turn a file ID into its path).
+        At most the per-device limits' worth of calls are in flight at any time.
+        """
+        active = {}
+        for item in items:
+            state = self._device(device_of(item))
+            state.queue.append(item)
+            active[id(state)] = state
+        if order_of is not None:
+            for state in active.values():
+                state.queue = deque(sorted(state.queue, key=order_of))
+
+        pending = {}
+
+        def fill():
+            for state in active.values():
+                while state.queue and state.inflight < state.limit:
+                    item = state.queue.popleft()
+                    pending[self.executor.submit(func, arg_of(item) if arg_of is not None else item)] = (item, state)
+                    state.inflight += 1
+
+        try:
+            fill()
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    item, state = pending.pop(future)
+                    state.inflight -= 1
+                    state.record(cost_of(item) if cost_of is not None else 0)
+                    yield item, future
+                fill()
+        finally:
+            # The consumer stopped early: drop queued work and anything not yet started.
+            for state in active.values():
+                state.queue.clear()
+            for future in pending:
+                future.cancel()
+            wait(pending)
+            for _, state in pending.values():
+                state.inflight -= 1
+
+    def close(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
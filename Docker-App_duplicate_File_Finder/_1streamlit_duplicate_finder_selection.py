@@ -0,0 +1,244 @@
+# _1streamlit_duplicate_finder_selection.py
+
+"""
+Keep/delete selection state for a finished scan.
+
+SelectionModel holds which paths of each duplicate set are kept, together with
+running totals (kept, to delete, unreviewed sets, bytes saved) that are updated
+only for the set that changed, so the app does not walk every set on each rerun.
+The scan report and the shell script are produced line by line by generators
+and only joined when the user asks to download them.
+"""
+
+import shlex
+from collections import Counter
+from datetime import datetime
+
+
+def format_bytes(byte_count):
+    if byte_count is None or byte_count == 0:
+        return "0 B"
+    power, n = 1024, 0
+    power_labels = {0: 'B', 1: 'KB', 2: 'MB', 3: 'GB', 4: 'TB'}
+    while byte_count >= power and n < len(power_labels) - 1:
+        byte_count /= power
+        n += 1
+    return f"{byte_count:.2f} {power_labels[n]}"
+
+
+def link_groups(data):
+    """Paths of a set grouped by inode; results without 'links' treat every path as its own file."""
+    return data.get('links') or [[path] for path in data['paths']]
+
+
+def externally_linked(data):
+    """Paths of a set whose inode also has hardlinks outside the scanned folders (deleting them frees nothing)."""
+    outside = data.get('external_links') or {}
+    return {path for group in link_groups(data) if group[0] in outside for path in group}
+
+
+def commented_path(path):
+    """A quoted path for a script comment; newlines are escaped so the rest of the name stays commented out."""
+    return shlex.quote(path).replace('\n', '\\n')
+
+
+# --- Script actions: how a duplicate that is not kept gets replaced ---
+SCRIPT_ACTIONS = {
+    "rm": "Delete duplicates (rm)",
+    "ln": "Replace with hardlinks (ln)",
+    "reflink": "Replace with reflink copies (cp --reflink)",
+}
+
+
+def script_commands_for_set(data, files_kept, action, kept_anywhere=frozenset(), handled=None):
+    """
+    Shell commands for the paths of one set that are not kept.
+    Paths in `kept_anywhere` are kept in another set (similar-image sets can overlap
+    byte-identical ones) and are never touched. `handled`, if given, is a set of paths
+    that earlier sets already have commands for; they are skipped and new ones added.
+    """
+    keep = sorted(files_kept)[0]
+    same_inode_as_keep = next((set(group) for group in link_groups(data) if keep in group), {keep})
+    linked_outside = externally_linked(data)
+    quoted_keep = shlex.quote(keep)
+    commands = []
+    for path in sorted(set(data['paths']) - files_kept):
+        quoted = shlex.quote(path)
+        if path in kept_anywhere:
+            commands.append(f'# kept in another set: {commented_path(path)}')
+        elif handled is not None and path in handled:
+            commands.append(f'# handled in an earlier set: {commented_path(path)}')
+        elif action == "rm":
+            if path in same_inode_as_keep:
+                note = f'  # hardlink of the kept file {commented_path(keep)}, frees no space'
+            elif path in linked_outside:
+                note = '  # hardlinked outside the scanned folders, frees no space'
+            else:
+                note = ''
+            commands.append(f'rm {quoted}{note}')
+        elif path in same_inode_as_keep:
+            commands.append(f'# already a hardlink of {commented_path(keep)}: {commented_path(path)}')
+        elif data.get('similar'):
+            commands.append(f'# similar to {commented_path(keep)} but not identical, left in place: {commented_path(path)}')
+            continue  # Still free for a byte-identical set to replace
+        elif action == "ln":
+            commands.append(f'ln -f {quoted_keep} {quoted}')
+        else:
+            commands.append(f'cp --reflink=always {quoted_keep} {quoted}')
+        if handled is not None:
+            handled.add(path)
+    return commands
+
+
+class SelectionModel:
+    """
+    Which paths of each duplicate set are kept, with incrementally maintained totals.
+    A path can be in several sets (a similar-image set overlaps the byte-identical sets of
+    its members), so totals count distinct paths and inodes: a path is deleted once some
+    reviewed set contains it and no set keeps it, and an inode's space is saved once all
+    of its paths are deleted.
+    """
+
+    def __init__(self, duplicates):
+        self.duplicates = duplicates
+        self.files_to_keep = {}
+        self.files_kept = 0
+        self.files_to_delete = 0
+        self.space_saved = 0
+        self.unreviewed_sets = len(duplicates)
+        # How many sets keep each path, so script generation can protect paths kept elsewhere.
+        self.kept_anywhere = Counter()
+        # How many reviewed sets (something kept) contain each path.
+        self._reviewed_in = Counter()
+        # Inode (first path of its link group) -> [paths, size, hardlinked outside the scan].
+        self._inodes = {}
+        self._inode_of = {}
+        for data in duplicates.values():
+            sizes = data.get('sizes', {})  # similar-image sets differ in size per file
+            outside = data.get('external_links') or {}
+            for group in link_groups(data):
+                inode = self._inode_of.get(group[0], group[0])
+                entry = self._inodes.setdefault(inode, [set(), sizes.get(group[0], data['size']), False])
+                entry[0].update(group)
+                entry[2] = entry[2] or group[0] in outside
+                self._inode_of.update(dict.fromkeys(group, inode))
+        self.total_files = len(self._inode_of)
+        # Bumped on every change; lets callers cache anything derived from the selection.
+        self.version = 0
+
+    def _deleted(self, path):
+        return self._reviewed_in[path] > 0 and path not in self.kept_anywhere
+
+    def _freed(self, inode):
+        # Space is only saved for an inode once none of its paths (hardlinks) are kept,
+        # and never for one that is also linked from outside the scanned folders.
+        paths, size, outside = self._inodes[inode]
+        return 0 if outside or not all(map(self._deleted, paths)) else size
+
+    def _add_totals(self, paths, inodes, sign):
+        self.files_kept += sign * sum(path in self.kept_anywhere for path in paths)
+        self.files_to_delete += sign * sum(map(self._deleted, paths))
+        self.space_saved += sign * sum(map(self._freed, inodes))
+
+    def _replace_kept(self, hash_val, new_kept):
+        """Only the paths of this set (and their inodes) are recounted."""
+        data = self.duplicates[hash_val]
+        paths = set(data['paths'])
+        inodes = {self._inode_of[path] for path in paths}
+        paths.update(path for inode in inodes for path in self._inodes[inode][0])
+        self._add_totals(paths, inodes, -1)
+        old_kept = self.files_to_keep.get(hash_val, ())
+        for path in old_kept:
+            self.kept_anywhere[path] -= 1
+            if self.kept_anywhere[path] <= 0:
+                del self.kept_anywhere[path]
+        if old_kept and not new_kept:
+            self._reviewed_in.subtract(data['paths'])
+            self.unreviewed_sets += 1
+        elif new_kept and not old_kept:
+            self._reviewed_in.update(data['paths'])
+            self.unreviewed_sets -= 1
+        if new_kept:
+            self.files_to_keep[hash_val] = new_kept
+            self.kept_anywhere.update(new_kept)
+        else:
+            self.files_to_keep.pop(hash_val, None)
+        self._add_totals(paths, inodes, 1)
+        self.version += 1
+
+    def kept(self, hash_val):
+        return self.files_to_keep.get(hash_val, set())
+
+    def toggle(self, hash_val, path):
+        """Flips one path between keep and delete; only that set's totals are recomputed."""
+        new_kept = set(self.kept(hash_val))
+        new_kept.symmetric_difference_update({path})
+        self._replace_kept(hash_val, new_kept)
+
+    def keep_shortest_paths(self):
+        """
+        Keeps the shortest path of each byte-identical set, preferring a file that is also
+        hardlinked outside the scanned folders (deleting that one would free nothing).
+        In similar-image sets the files differ, so the largest one (the likely original)
+        is kept instead; among equally large files, one already kept by a byte-identical
+        set wins, so the two kinds of sets don't keep different copies of the same image.
+        """
+        similar = [hash_val for hash_val, data in self.duplicates.items() if data.get('similar')]
+        for hash_val, data in self.duplicates.items():
+            if not data.get('similar'):
+                linked_outside = externally_linked(data)
+                self._replace_kept(hash_val, {min(data['paths'], key=lambda path: (path not in linked_outside, len(path)))})
+        for hash_val in similar:
+            data = self.duplicates[hash_val]
+            sizes = data.get('sizes', {})
+            keep = max(data['paths'], key=lambda path: (sizes.get(path, data['size']), path in self.kept_anywhere, -len(path)))
+            self._replace_kept(hash_val, {keep})
+
+    def clear(self):
+        for hash_val in list(self.files_to_keep):
+            self._replace_kept(hash_val, set())
+
+    def unreviewed(self):
+        """Yields (set number, hash, data) for sets where nothing is kept yet."""
+        for i, (hash_val, data) in enumerate(self.duplicates.items(), 1):
+            if hash_val not in self.files_to_keep:
+                yield i, hash_val, data
+
+    def iter_report_lines(self, hardlink_sets=None):
+        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        yield f"Duplicate File Scan Report\nGenerated on: {timestamp}\n" + "=" * 40
+        if not self.duplicates:
+            yield "No duplicate files were found."
+            return
+        for i, (hash_val, data) in enumerate(self.duplicates.items(), 1):
+            yield f"\n--- Set {i} | Hash ({data.get('algorithm', 'sha256')}): {hash_val} ---"
+            kept_in_set = self.files_to_keep.get(hash_val)
+            if not kept_in_set:
+                yield "  [UNREVIEWED] This set has not been reviewed."
+                for path in sorted(data['paths']):
+                    yield f"    - {path}"
+                continue
+            hardlinked = {path for group in link_groups(data) if len(group) > 1 for path in group}
+            linked_outside = externally_linked(data)
+            for path in sorted(data['paths']):
+                status = "[KEEP]" if path in kept_in_set else "[DELETE]"
+                note = ' (hardlinked outside the scan, frees no space)' if path in linked_outside else ' (hardlinked)' if path in hardlinked else ''
+                yield f"  {status} {path}{note}"
+        if hardlink_sets:
+            yield "\n" + "=" * 40 + "\nHardlink Sets (same file under several paths, nothing to reclaim)"
+            for i, data in enumerate(hardlink_sets.values(), 1):
+                yield f"\n--- Hardlink Set {i} | {format_bytes(data['size'])} ---"
+                for path in sorted(data['paths']):
+                    yield f"    - {path}"
+
+    def iter_script_lines(self, action="rm"):
+        handled = set()  # A path in several sets gets one command
+        for i, (hash_val, data) in enumerate(self.duplicates.items(), 1):
+            files_kept = self.files_to_keep.get(hash_val)
+            if not files_kept:
+                continue
+            set_commands = script_commands_for_set(data, files_kept, action, self.kept_anywhere, handled)
+            if set_commands:
+                yield f"# Set {i}: {hash_val[:12]}..."
+                yield from set_commands
+                yield ""
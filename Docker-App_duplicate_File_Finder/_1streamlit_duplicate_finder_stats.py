@@ -0,0 +1,105 @@
+# _1streamlit_duplicate_finder_stats.py
+
+"""
+Per-stage metrics for a scan.
+
+iter_duplicate_groups fills a ScanStats with one StageStats per stage it runs
+(walk, partial hash, sampling, byte compare, full hash, ...): wall time, files
+in and out, bytes read, errors that were skipped over and hash cache hits.
+Each finished stage is also logged on the "duplicate_finder.stats" logger and
+passed to an optional on_stage callback.
+"""
+
+import logging
+import time
+
+from _1streamlit_duplicate_finder_filetable import peak_rss_bytes
+
+logger = logging.getLogger("duplicate_finder.stats")
+
+
+class StageStats:
+    """Metrics of one stage. Wall time includes time the consumer spends between yielded sets."""
+
+    def __init__(self, name):
+        self.name = name
+        self.wall_time = 0.0
+        self.files_in = 0
+        self.files_out = 0
+        self.bytes_read = 0
+        self.errors = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    @property
+    def mb_per_s(self):
+        return self.bytes_read / (1024 * 1024) / self.wall_time if self.wall_time else 0.0
+
+    def as_dict(self):
+        return {'stage': self.name, 'wall_time': round(self.wall_time, 3), 'files_in': self.files_in,
+                'files_out': self.files_out, 'bytes_read': self.bytes_read, 'mb_per_s': round(self.mb_per_s, 1),
+                'errors': self.errors, 'cache_hits': self.cache_hits, 'cache_misses': self.cache_misses}
+
+    def __repr__(self):
+        return (f"{self.name}: {self.wall_time:.2f} s, {self.files_in} -> {self.files_out} files, "
+                f"{self.bytes_read / (1024 * 1024):.1f} MB ({self.mb_per_s:.1f} MB/s), {self.errors} errors, "
+                f"cache {self.cache_hits} hits / {self.cache_misses} misses")
+
+
+class _StageTimer:
+    def __init__(self, scan_stats, stage, cache):
+        self.scan_stats = scan_stats
+        self.stage = stage
+        self.cache = cache
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        if self.cache is not None:
+            self.hits, self.misses = self.cache.hits, self.cache.misses
+        return self.stage
+
+    def __exit__(self, *exc_info):
+        self.stage.wall_time = time.perf_counter() - self.started
+        if self.cache is not None:
+            self.stage.cache_hits = self.cache.hits - self.hits
+            self.stage.cache_misses = self.cache.misses - self.misses
+        self.scan_stats._finish(self.stage)
+
+
+class ScanStats:
+    """
+    Collects StageStats for one scan. Pass it to iter_duplicate_groups / find_duplicate_files
+    as `stats`; `on_stage` is called with each StageStats when that stage ends.
+    """
+
+    def __init__(self, on_stage=None):
+        self.on_stage = on_stage
+        self.stages = []
+        self.started = time.perf_counter()
+        self.wall_time = 0.0
+        self.peak_rss = None
+
+    def stage(self, name, cache=None):
+        """Context manager timing one stage; yields its StageStats to fill in."""
+        stage = StageStats(name)
+        self.stages.append(stage)
+        return _StageTimer(self, stage, cache)
+
+    def _finish(self, stage):
+        self.wall_time = time.perf_counter() - self.started
+        self.peak_rss = peak_rss_bytes()
+        logger.info("%r", stage)
+        if self.on_stage is not None:
+            self.on_stage(stage)
+
+    @property
+    def bytes_read(self):
+        return sum(stage.bytes_read for stage in self.stages)
+
+    @property
+    def errors(self):
+        return sum(stage.errors for stage in self.stages)
+
+    def as_dict(self):
+        return {'wall_time': round(self.wall_time, 3), 'peak_rss': self.peak_rss, 'bytes_read': self.bytes_read,
+                'errors': self.errors, 'stages': [stage.as_dict() for stage in self.stages]}
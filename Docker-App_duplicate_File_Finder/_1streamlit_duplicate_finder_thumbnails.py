@@ -0,0 +1,92 @@
+# _1streamlit_duplicate_finder_thumbnails.py
+
+"""
+On-disk thumbnail cache for the review tab.
+
+Each duplicate set is shown with a small JPEG made once from its first image,
+keyed by the set's content hash, instead of sending the full-size original to
+the browser on every rerun. The cache is a plain folder capped at a total size;
+files are touched when used and the least recently used ones are deleted first.
+"""
+
+import hashlib
+import os
+
+try:
+    from PIL import Image, ImageOps
+    PIL_AVAILABLE = True
+except ImportError:
+    PIL_AVAILABLE = False
+
+DEFAULT_THUMBNAIL_DIR = os.environ.get(
+    "DUPLICATE_FINDER_THUMBNAILS",
+    os.path.join(os.path.expanduser("~"), ".cache", "duplicate_finder", "thumbnails"),
+)
+THUMBNAIL_SIZE = 200
+MAX_CACHE_BYTES = 256 * 1024 * 1024
+# Eviction trims the cache to this fraction of the cap, so it doesn't run on every new thumbnail.
+EVICT_TO_FRACTION = 0.9
+
+
+class ThumbnailCache:
+    """Creates and serves size-capped, LRU-evicted JPEG thumbnails."""
+
+    def __init__(self, cache_dir=DEFAULT_THUMBNAIL_DIR, max_bytes=MAX_CACHE_BYTES, size=THUMBNAIL_SIZE):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.size = size
+        os.makedirs(cache_dir, exist_ok=True)
+        self.total_bytes = sum(entry.stat().st_size for entry in os.scandir(cache_dir) if entry.is_file())
+
+    def _path_for(self, key):
+        name = hashlib.sha256(key.encode('utf-8', 'surrogateescape')).hexdigest()[:32]
+        return os.path.join(self.cache_dir, f"{name}_{self.size}.jpg")
+
+    def get(self, key, source_path):
+        """
+        Returns the path of the thumbnail for `key` (a content hash), creating it from
+        `source_path` if needed, or None if the image can't be decoded.
+        """
+        thumb_path = self._path_for(key)
+        try:
+            os.utime(thumb_path)  # Mark as recently used
+            return thumb_path
+        except OSError:
+            pass
+        if not PIL_AVAILABLE:
+            return None
+        try:
+            with Image.open(source_path) as img:
+                img.draft('RGB', (self.size, self.size))
+                img = ImageOps.exif_transpose(img)
+                img.thumbnail((self.size, self.size))
+                tmp_path = f"{thumb_path}.{os.getpid()}.tmp"
+                img.convert('RGB').save(tmp_path, 'JPEG', quality=80)
+            os.replace(tmp_path, thumb_path)
+        except Exception:
+            return None
+        self.total_bytes += os.path.getsize(thumb_path)
+        if self.total_bytes > self.max_bytes:
+            self.evict()
+        return thumb_path
+
+    def evict(self):
+        """Deletes least recently used thumbnails until the cache is below its target size."""
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            try:
+                st = entry.stat()
+                entries.append((st.st_mtime, st.st_size, entry.path))
+            except OSError:
+                continue
+        entries.sort()
+        self.total_bytes = sum(size for _, size, _ in entries)
+        target = self.max_bytes * EVICT_TO_FRACTION
+        for _, size, path in entries:
+            if self.total_bytes <= target:
+                break
+            try:
+                os.remove(path)
+                self.total_bytes -= size
+            except OSError:
+                pass
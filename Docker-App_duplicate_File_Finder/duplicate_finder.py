@@ -0,0 +1,359 @@
+# duplicate_finder.py
+
+"""
+What:
+Command line entry point for batch / cron scans, without Streamlit.
+Duplicate sets are written as NDJSON (one JSON object per set) or CSV
+(one row per path) as soon as each set is confirmed, so the output can be
+piped straight into other tools. Scans can also write a manifest per shard
+(host or volume), and manifests from several shards can be merged.
+
+How to Run:
+python -m duplicate_finder scan /photos /backup --exclude /photos/tmp > duplicates.ndjson
+python -m duplicate_finder scan /photos --format csv --output duplicates.csv
+docker run --rm -v /photos:/photos ghcr.io/mk25dec/duplicate-finder:latest python -m duplicate_finder scan /photos
+
+Sharded scans (one manifest per host or volume, merged without rescanning):
+host1$ python -m duplicate_finder scan /photos --manifest host1.dfm --shard-name host1 --manifest-all-digests > /dev/null
+host2$ python -m duplicate_finder scan /archive --manifest host2.dfm --shard-name host2 --manifest-all-digests > /dev/null
+python -m duplicate_finder merge host1.dfm host2.dfm > duplicates.ndjson
+
+Exit codes (like diff):
+0 no duplicates found, 1 duplicates found, 2 usage or scan error, 130 interrupted.
+merge exits 3 when some candidates could not be hashed; they are written as
+'unresolved' sets (scan with --manifest-all-digests to avoid them).
+Stage log lines go to stderr; stdout only carries the results.
+
+--max-memory bounds what the scan allocates on top of the interpreter and a
+1 MiB stack per worker thread (see limit_memory).
+"""
+
+import argparse
+import contextlib
+import csv
+import ctypes
+import ctypes.util
+import json
+import os
+import signal
+import sqlite3
+import sys
+import threading
+
+from _1streamlit_duplicate_finder_logic import (iter_duplicate_groups, HASH_ALGORITHMS, NON_CRYPTOGRAPHIC_ALGORITHMS,
+                                                 COMPARE_GROUP_THRESHOLD, SAMPLE_STAGES, CHUNK_SIZE_LARGE)
+from _1streamlit_duplicate_finder_cache import HashCache, DEFAULT_CACHE_PATH
+from _1streamlit_duplicate_finder_perceptual import PERCEPTUAL_METHODS, PERCEPTUAL_THRESHOLD
+from _1streamlit_duplicate_finder_stats import ScanStats
+from _1streamlit_duplicate_finder_manifest import iter_merged_duplicate_groups
+
+try:
+    import resource
+    RESOURCE_AVAILABLE = True
+except ImportError:  # Windows
+    RESOURCE_AVAILABLE = False
+
+EXIT_NO_DUPLICATES = 0
+EXIT_DUPLICATES_FOUND = 1
+EXIT_ERROR = 2
+EXIT_UNRESOLVED = 3
+EXIT_INTERRUPTED = 130
+
+# With --max-memory, worker threads get small stacks and share glibc's main malloc arena
+# (mallopt's M_ARENA_MAX) instead of reserving a 64 MiB arena each; see limit_memory.
+THREAD_STACK_SIZE = 1024 ** 2
+MALLOC_ARENA_SIZE = 64 * 1024 ** 2
+M_ARENA_MAX = -8
+
+CSV_COLUMNS = ('set', 'hash', 'algorithm', 'size', 'inode_group', 'path', 'shard')
+
+
+# --- Output writers: each gets (set number, hash, data) for every set as it is found ---
+class NdjsonWriter:
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, set_number, hash_val, data):
+        record = {'set': set_number, 'hash': hash_val}
+        record.update(data)
+        self.stream.write(json.dumps(record, ensure_ascii=False, sort_keys=True) + "\n")
+        self.stream.flush()
+
+
+class CsvWriter:
+    def __init__(self, stream):
+        self.stream = stream
+        self.writer = csv.writer(stream)
+        self.writer.writerow(CSV_COLUMNS)
+
+    def write(self, set_number, hash_val, data):
+        sizes = data.get('sizes', {})
+        links = data.get('links') or [[path] for path in data['paths']]
+        shards = iter(data.get('shards') or ())  # Merged sets name the shard of each path, in 'paths' order
+        for group_number, group in enumerate(links, 1):
+            for path in group:
+                self.writer.writerow((set_number, hash_val, data.get('algorithm', 'sha256'),
+                                      sizes.get(path, data['size']), group_number, path, next(shards, '')))
+        self.stream.flush()
+
+
+OUTPUT_FORMATS = {'ndjson': NdjsonWriter, 'csv': CsvWriter}
+
+
+def parse_size(text):
+    """'512M', '4G', '1024' (bytes) -> bytes, for --max-memory and --chunk-size; must be positive."""
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+    text = text.strip().upper().rstrip('B')
+    try:
+        if text and text[-1] in units:
+            size = int(float(text[:-1]) * units[text[-1]])
+        else:
+            size = int(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid size '{text}' (use e.g. 512M or 4G)")
+    if size <= 0:
+        # A 0-byte read buffer would read nothing and make every candidate "match".
+        raise argparse.ArgumentTypeError(f"size must be positive, got '{text}'")
+    return size
+
+
+def parse_sample_stages(text):
+    try:
+        return tuple(int(n) for n in text.replace(' ', '').split(',') if n)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid sample stages '{text}' (use e.g. 8 or 4,16)")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="duplicate_finder", description="Find duplicate files without the Streamlit UI.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    # Options shared by every command that writes duplicate sets.
+    output = argparse.ArgumentParser(add_help=False)
+    output.add_argument('-f', '--format', choices=list(OUTPUT_FORMATS), default='ndjson', help="Output format (default: ndjson).")
+    output.add_argument('-o', '--output', default='-', help="Output file (default: stdout).")
+    output.add_argument('-q', '--quiet', action='store_true', help="Don't log stages to stderr.")
+    output.add_argument('--stats', metavar='FILE', default=None, help="Write per-stage timings and throughput as JSON to FILE.")
+    output.add_argument('-j', '--workers', type=int, default=None, help="Maximum concurrent discovery/hashing workers.")
+    output.add_argument('--max-memory', type=parse_size, default=None, metavar='SIZE',
+                        help="Abort (exit 2) once the scan's own allocations would exceed SIZE, e.g. 4G. Enforced as an "
+                             "address space limit of SIZE plus what the interpreter maps at startup (typically 30-60 MiB) "
+                             "and a 1 MiB stack per worker thread (-j; up to 64 by default).")
+
+    scan = subparsers.add_parser('scan', parents=[output], help="Scan folders and stream the duplicate sets found.")
+    scan.add_argument('roots', nargs='+', help="Folders to scan.")
+    scan.add_argument('-e', '--exclude', action='append', default=[], metavar='DIR', help="Folder to exclude (repeatable).")
+    scan.add_argument('--manifest', metavar='FILE', default=None, help="Also write a manifest of all files and digests, for 'merge'.")
+    scan.add_argument('--shard-name', default=None, help="Name of this shard in the manifest (default: host name).")
+    scan.add_argument('--manifest-all-digests', action='store_true',
+                      help="Hash every file for the manifest, not only this shard's candidates, so a merge never needs "
+                           "to reach the files (needed when merging on another host).")
+    scan.add_argument('--host-id', default=None,
+                      help="Machine identity stored in the manifest; shards with the same one are matched by inode "
+                           "(default: host name and machine ID). Set it when containers on one host scan shared volumes.")
+
+    hashing = scan.add_argument_group("hashing")
+    hashing.add_argument('--algorithm', choices=list(HASH_ALGORITHMS), default='sha256', help="Grouping hash (default: sha256).")
+    hashing.add_argument('--confirm-sha256', action=argparse.BooleanOptionalAction, default=None,
+                         help="Re-hash final groups with SHA-256 (default: on for non-cryptographic algorithms).")
+    hashing.add_argument('--chunk-size', type=parse_size, default=CHUNK_SIZE_LARGE, help="Read buffer for full hashing (default: 1M).")
+    hashing.add_argument('--sample-stages', type=parse_sample_stages, default=SAMPLE_STAGES,
+                         help=f"Comma-separated sampled fingerprint block counts, '' to skip (default: {','.join(map(str, SAMPLE_STAGES))}).")
+    hashing.add_argument('--compare-threshold', type=int, default=COMPARE_GROUP_THRESHOLD,
+                         help=f"Byte-compare candidate groups of up to N files instead of hashing (default: {COMPARE_GROUP_THRESHOLD}).")
+    hashing.add_argument('--require-digest', action='store_true', help="Always key sets by a content digest, also for byte-compared groups.")
+    hashing.add_argument('--keep-page-cache', action='store_true', help="Don't drop hashed files from the page cache.")
+    hashing.add_argument('--processes', action='store_true', help="Hash in separate processes instead of threads.")
+
+    cache = scan.add_argument_group("hash cache")
+    cache.add_argument('--cache', default=DEFAULT_CACHE_PATH, help=f"SQLite hash cache (default: {DEFAULT_CACHE_PATH}).")
+    cache.add_argument('--no-cache', action='store_true', help="Read every file; don't use the hash cache.")
+    cache.add_argument('--verify-cache', action='store_true', help="Re-hash cached files and fix stale entries.")
+    cache.add_argument('--clear-cache', nargs='?', const='', default=None, metavar='PATH',
+                       help="Before scanning, drop the cached hashes of files under PATH (or of all files if PATH is omitted).")
+
+    extra = scan.add_argument_group("extra sets")
+    extra.add_argument('--hardlinks', action='store_true', help="Also report files that are only hardlinked.")
+    extra.add_argument('--similar', choices=PERCEPTUAL_METHODS, default=None, help="Also find visually similar images (needs Pillow and NumPy).")
+    extra.add_argument('--similar-threshold', type=int, default=PERCEPTUAL_THRESHOLD,
+                       help=f"Max Hamming distance (of 64 bits) for similar images (default: {PERCEPTUAL_THRESHOLD}).")
+
+    merge = subparsers.add_parser('merge', parents=[output], help="Find duplicates across manifests written by 'scan --manifest'.")
+    merge.add_argument('manifests', nargs='+', help="Manifest files, one per shard.")
+    merge.add_argument('--algorithm', choices=list(HASH_ALGORITHMS), default=None,
+                       help="Hash to match on (default: the first manifest's grouping hash).")
+    merge.add_argument('--confirm-sha256', action=argparse.BooleanOptionalAction, default=None,
+                       help="Re-check final groups with SHA-256 (default: on if any shard was scanned with it).")
+    merge.add_argument('--no-lazy-hash', action='store_true',
+                       help="Never read files; candidates a shard has no digest for are reported as unresolved.")
+    return parser
+
+
+def shrink_worker_reservations():
+    """
+    Makes worker threads reserve as little address space as possible before any are
+    started: THREAD_STACK_SIZE stacks instead of RLIMIT_STACK (often 8 MiB or more) and,
+    on glibc, one shared malloc arena instead of a 64 MiB arena per thread (like
+    MALLOC_ARENA_MAX=1; the threads allocate under the GIL, so they don't contend for it).
+    Returns what the workers still reserve per thread.
+    """
+    threading.stack_size(THREAD_STACK_SIZE)
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'))
+        arenas_shared = libc.mallopt(M_ARENA_MAX, 1) == 1
+    except (OSError, AttributeError, TypeError):  # Not glibc
+        arenas_shared = False
+    return THREAD_STACK_SIZE if arenas_shared else THREAD_STACK_SIZE + MALLOC_ARENA_SIZE
+
+
+def current_address_space():
+    """Address space the process maps already (interpreter, loaded modules); 0 where /proc is missing."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[0]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def limit_memory(max_bytes, workers=None):
+    """
+    Caps the process address space (RLIMIT_AS) at max_bytes on top of what is mapped
+    already and the (shrunk) stacks of the worker threads, so max_bytes bounds what the
+    scan allocates itself; allocations beyond it raise MemoryError.
+    """
+    if not RESOURCE_AVAILABLE:
+        raise RuntimeError("--max-memory is not supported on this platform")
+    if workers is None:
+        workers = min(64, (os.cpu_count() or 1) * 4)  # DeviceScheduler's default
+    max_bytes += current_address_space() + workers * shrink_worker_reservations()
+    _, hard = resource.getrlimit(resource.RLIMIT_AS)
+    if hard != resource.RLIM_INFINITY:
+        max_bytes = min(max_bytes, hard)
+    resource.setrlimit(resource.RLIMIT_AS, (max_bytes, hard))
+
+
+def run_scan(args, out_stream, cancel_event, stats=None):
+    """Streams the sets to out_stream and returns (sets written, unresolved groups)."""
+    if args.clear_cache is not None:
+        with HashCache(args.cache) as cache:
+            removed = cache.invalidate(args.clear_cache or None)
+        print(f"Hash cache: {removed} entries cleared" + (f" under {args.clear_cache}." if args.clear_cache else "."))
+    writer = OUTPUT_FORMATS[args.format](out_stream)
+    scan_options = dict(
+        cache_path=None if args.no_cache else args.cache,
+        verify_cache=args.verify_cache,
+        max_workers=args.workers,
+        hash_algorithm=args.algorithm,
+        confirm_with_sha256=args.algorithm in NON_CRYPTOGRAPHIC_ALGORITHMS if args.confirm_sha256 is None else args.confirm_sha256,
+        chunk_size=args.chunk_size,
+        sample_stages=args.sample_stages,
+        compare_threshold=args.compare_threshold,
+        require_digest=args.require_digest,
+        drop_page_cache=not args.keep_page_cache,
+        use_processes=args.processes,
+        report_hardlinks=args.hardlinks,
+        perceptual_method=args.similar,
+        perceptual_threshold=args.similar_threshold,
+        manifest_path=args.manifest,
+        shard_name=args.shard_name,
+        host_id=args.host_id,
+        manifest_all_digests=args.manifest_all_digests,
+        cancel_event=cancel_event,
+        stats=stats,
+    )
+    sets_written = 0
+    for hash_val, data in iter_duplicate_groups(args.roots, args.exclude, **scan_options):
+        sets_written += 1
+        writer.write(sets_written, hash_val, data)
+    return sets_written, 0
+
+
+def run_merge(args, out_stream, cancel_event, stats=None):
+    """Streams the cross-shard sets to out_stream and returns (sets written, unresolved groups)."""
+    writer = OUTPUT_FORMATS[args.format](out_stream)
+    sets_written = unresolved = 0
+    for hash_val, data in iter_merged_duplicate_groups(args.manifests, hash_algorithm=args.algorithm,
+                                                       confirm_with_sha256=args.confirm_sha256,
+                                                       lazy_hash=not args.no_lazy_hash,
+                                                       max_workers=args.workers, stats=stats):
+        if cancel_event.is_set():
+            break
+        sets_written += 1
+        unresolved += data['algorithm'] == 'unresolved'
+        writer.write(sets_written, hash_val, data)
+    return sets_written, unresolved
+
+
+COMMANDS = {'scan': run_scan, 'merge': run_merge}
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    if args.command == 'scan':
+        missing = [root for root in args.roots if not os.path.isdir(root)]
+        if missing:
+            parser.error(f"not a folder: {', '.join(missing)}")
+    else:
+        missing = [manifest for manifest in args.manifests if not os.path.isfile(manifest)]
+        if missing:
+            parser.error(f"no such manifest: {', '.join(missing)}")
+    if args.max_memory is not None:
+        try:
+            limit_memory(args.max_memory, args.workers)
+        except (RuntimeError, ValueError, OSError) as e:
+            parser.error(str(e))
+
+    # First Ctrl-C / SIGTERM stops the scan cleanly (sets found so far are kept); a second one aborts.
+    cancel_event = threading.Event()
+
+    def on_signal(signum, frame):
+        if cancel_event.is_set():
+            raise KeyboardInterrupt
+        cancel_event.set()
+        print("Interrupted, stopping scan...", file=sys.stderr)
+
+    signal.signal(signal.SIGINT, on_signal)
+    signal.signal(signal.SIGTERM, on_signal)
+
+    # The scan logs its stages with print(); keep stdout for the results.
+    log_stream = open(os.devnull, 'w') if args.quiet else sys.stderr
+    try:
+        with contextlib.ExitStack() as stack:
+            if args.output == '-':
+                out_stream = sys.stdout
+            else:
+                out_stream = stack.enter_context(open(args.output, 'w', encoding='utf-8', newline=''))
+            stack.enter_context(contextlib.redirect_stdout(log_stream))
+            stats = ScanStats(on_stage=print)  # Per-stage summary lines go to the stage log
+            sets_written, unresolved = COMMANDS[args.command](args, out_stream, cancel_event, stats)
+        if args.stats:
+            with open(args.stats, 'w', encoding='utf-8') as f:
+                json.dump(stats.as_dict(), f, indent=2)
+    except KeyboardInterrupt:
+        return EXIT_INTERRUPTED
+    except MemoryError:
+        print("Error: the scan exceeded --max-memory.", file=sys.stderr)
+        return EXIT_ERROR
+    except BrokenPipeError:
+        # The reader went away (e.g. `| head`); that is not an error of the scan.
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.__stdout__.fileno())
+        return EXIT_INTERRUPTED if cancel_event.is_set() else EXIT_DUPLICATES_FOUND
+    except (OSError, ValueError, RuntimeError, sqlite3.Error) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return EXIT_ERROR
+    finally:
+        if args.quiet:
+            log_stream.close()
+
+    if cancel_event.is_set():
+        return EXIT_INTERRUPTED
+    if unresolved:
+        print(f"Warning: {unresolved} groups have candidates that could not be hashed (see the 'unresolved' sets).", file=sys.stderr)
+        return EXIT_UNRESOLVED
+    return EXIT_DUPLICATES_FOUND if sets_written else EXIT_NO_DUPLICATES
+
+
+if __name__ == '__main__':
+    sys.exit(main())
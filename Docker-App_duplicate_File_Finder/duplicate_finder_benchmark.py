@@ -0,0 +1,271 @@
+# duplicate_finder_benchmark.py
+
+"""
+What:
+Reproducible benchmark for the scanner. Builds synthetic file trees in a temp
+folder, scans each one with a cold and a warm page cache and writes the
+per-stage timings, throughput and peak memory as JSON, so two versions can
+be compared run for run.
+
+Cases:
+tiny_files     many files of a few hundred bytes (discovery / open() overhead)
+same_size      many files of one size with different content (partial hashing)
+shared_prefix  large files with a common header that differ later (sampling / full hashing)
+deep_nesting   small files spread over deeply nested folders (directory walk)
+hardlinks      files reachable under several hardlinked paths (inode collapsing)
+
+How to Run:
+python -m duplicate_finder_benchmark --output bench_$(git rev-parse --short HEAD).json
+python -m duplicate_finder_benchmark --cases same_size,shared_prefix --scale 4 --repeat 3
+
+Cold runs drop every file of the tree from the page cache (posix_fadvise
+DONTNEED, no root needed) before scanning; warm runs read every file first and
+scan without dropping pages. Both states scan with the same options (the
+scanner's own page cache dropping is on unless --keep-page-cache is given), so
+only the starting cache state differs. Each scan runs in a fresh process so its
+peak RSS is its own. The hash cache is off so every run does the same work.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import platform
+import random
+import shutil
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from _1streamlit_duplicate_finder_logic import find_duplicate_files, HASH_ALGORITHMS
+from _1streamlit_duplicate_finder_stats import ScanStats
+
+KIB = 1024
+MIB = 1024 * 1024
+# Fraction of files in each case that get one or more byte-identical copies.
+DUPLICATE_FRACTION = 0.1
+
+
+# --- Synthetic tree generators: each takes (root, rng, scale) and writes files below root ---
+def _write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def _count(base, scale):
+    # Small scales still need enough files for the duplicate fraction to produce some copies.
+    return max(10, int(base * scale))
+
+
+def _add_copies(rng, written, root):
+    """Copies DUPLICATE_FRACTION of `written` (path, data) pairs into a 'copies' folder."""
+    for n, (path, data) in enumerate(rng.sample(written, int(len(written) * DUPLICATE_FRACTION))):
+        _write(os.path.join(root, "copies", f"{n:06d}_{os.path.basename(path)}"), data)
+
+
+def generate_tiny_files(root, rng, scale):
+    written = []
+    for i in range(_count(20000, scale)):
+        path = os.path.join(root, f"d{i % 100:02d}", f"t{i:06d}.txt")
+        data = rng.randbytes(rng.randint(1, 512))
+        _write(path, data)
+        written.append((path, data))
+    _add_copies(rng, written, root)
+
+
+def generate_same_size(root, rng, scale):
+    written = []
+    for i in range(_count(2000, scale)):
+        path = os.path.join(root, f"d{i % 20:02d}", f"s{i:05d}.bin")
+        data = rng.randbytes(64 * KIB)
+        _write(path, data)
+        written.append((path, data))
+    _add_copies(rng, written, root)
+
+
+def generate_shared_prefix(root, rng, scale):
+    # Same size and the same first 2 MiB (think camera RAW files or VM images from one template).
+    prefix = rng.randbytes(2 * MIB)
+    written = []
+    for i in range(_count(24, scale)):
+        path = os.path.join(root, f"p{i:03d}.img")
+        data = prefix + rng.randbytes(2 * MIB)
+        _write(path, data)
+        written.append((path, data))
+    _add_copies(rng, written, root)
+
+
+def generate_deep_nesting(root, rng, scale):
+    written = []
+    for i in range(_count(5000, scale)):
+        depth = rng.randint(10, 40)
+        folder = os.path.join(root, *(f"n{(i + level) % 7}" for level in range(depth)))
+        path = os.path.join(folder, f"f{i:05d}.dat")
+        data = rng.randbytes(rng.randint(1 * KIB, 16 * KIB))
+        _write(path, data)
+        written.append((path, data))
+    _add_copies(rng, written, root)
+
+
+def generate_hardlinks(root, rng, scale):
+    written = []
+    for i in range(_count(2000, scale)):
+        path = os.path.join(root, "originals", f"h{i:05d}.bin")
+        data = rng.randbytes(rng.randint(4 * KIB, 128 * KIB))
+        _write(path, data)
+        written.append((path, data))
+        for link in range(rng.randint(1, 3)):
+            link_path = os.path.join(root, f"links{link}", f"h{i:05d}.bin")
+            os.makedirs(os.path.dirname(link_path), exist_ok=True)
+            os.link(path, link_path)
+    _add_copies(rng, written, root)
+
+
+CASES = {
+    'tiny_files': generate_tiny_files,
+    'same_size': generate_same_size,
+    'shared_prefix': generate_shared_prefix,
+    'deep_nesting': generate_deep_nesting,
+    'hardlinks': generate_hardlinks,
+}
+
+
+def tree_summary(root):
+    """(number of paths, number of distinct inodes, bytes stored once per inode)."""
+    paths, inodes, total = 0, set(), 0
+    for dir_path, _, names in os.walk(root):
+        for name in names:
+            st = os.stat(os.path.join(dir_path, name), follow_symlinks=False)
+            paths += 1
+            if (st.st_dev, st.st_ino) not in inodes:
+                inodes.add((st.st_dev, st.st_ino))
+                total += st.st_size
+    return paths, len(inodes), total
+
+
+# --- Page cache control ---
+def drop_from_page_cache(root):
+    if not hasattr(os, 'posix_fadvise'):
+        raise RuntimeError("Cold runs need posix_fadvise (Linux).")
+    for dir_path, _, names in os.walk(root):
+        for name in names:
+            fd = os.open(os.path.join(dir_path, name), os.O_RDONLY)
+            try:
+                os.fsync(fd)  # Dirty pages can't be dropped until they are written back
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+            finally:
+                os.close(fd)
+
+
+def read_into_page_cache(root):
+    for dir_path, _, names in os.walk(root):
+        for name in names:
+            with open(os.path.join(dir_path, name), 'rb', buffering=0) as f:
+                while f.read(MIB):
+                    pass
+
+
+def _scan(root, scan_options):
+    """Runs in a fresh worker process: one scan, returning its stats and result size."""
+    stats = ScanStats()
+    with contextlib.redirect_stdout(io.StringIO()):
+        duplicates = find_duplicate_files([root], stats=stats, **scan_options)
+    return {'duplicate_sets': len(duplicates),
+            'duplicate_paths': sum(len(data['paths']) for data in duplicates.values()),
+            'stats': stats.as_dict()}
+
+
+def run_scan(root, scan_options):
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+        return executor.submit(_scan, root, scan_options).result()
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="duplicate_finder_benchmark", description="Benchmark the duplicate scanner on synthetic trees.")
+    parser.add_argument('--cases', default=",".join(CASES), help=f"Comma-separated cases (default: all of {', '.join(CASES)}).")
+    parser.add_argument('--cache-states', default="cold,warm", help="Comma-separated page cache states to run: cold, warm (default: both).")
+    parser.add_argument('--scale', type=float, default=1.0, help="Multiplies the number of files in every case (default: 1).")
+    parser.add_argument('--repeat', type=int, default=1, help="Scans per case and cache state (default: 1).")
+    parser.add_argument('--seed', type=int, default=0, help="Random seed; the same seed and scale give identical trees.")
+    parser.add_argument('--workdir', default=None, help="Where to build the trees (default: a new temp folder). Its filesystem is what gets measured.")
+    parser.add_argument('--keep', action='store_true', help="Keep the generated trees.")
+    parser.add_argument('--algorithm', choices=list(HASH_ALGORITHMS), default='sha256', help="Grouping hash (default: sha256).")
+    parser.add_argument('--workers', type=int, default=None, help="max_workers passed to the scanner.")
+    parser.add_argument('--keep-page-cache', action='store_true',
+                        help="Scan with drop_page_cache=False (default: the scanner's default, True), for cold and warm runs alike.")
+    parser.add_argument('-o', '--output', default='benchmark_results.json', help="JSON results file (default: benchmark_results.json).")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    cases = [case.strip() for case in args.cases.split(',') if case.strip()]
+    cache_states = [state.strip() for state in args.cache_states.split(',') if state.strip()]
+    unknown = [case for case in cases if case not in CASES] + [s for s in cache_states if s not in ('cold', 'warm')]
+    if unknown:
+        build_parser().error(f"unknown case or cache state: {', '.join(unknown)}")
+
+    workdir = tempfile.mkdtemp(prefix="duplicate_finder_bench_", dir=args.workdir)
+    results = {
+        'revision': git_revision(),
+        'timestamp': time.strftime("%Y-%m-%dT%H:%M:%S"),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'options': {'scale': args.scale, 'seed': args.seed, 'algorithm': args.algorithm, 'workers': args.workers,
+                    'drop_page_cache': not args.keep_page_cache},
+        'runs': [],
+    }
+    try:
+        for case in cases:
+            root = os.path.join(workdir, case)
+            print(f"Generating {case}...")
+            started = time.perf_counter()
+            CASES[case](root, random.Random(f"{args.seed}:{case}"), args.scale)
+            paths, inodes, total_bytes = tree_summary(root)
+            print(f"  {paths} paths, {inodes} files, {total_bytes / MIB:.1f} MB in {time.perf_counter() - started:.1f} s")
+
+            # The scan itself runs the same way in both states; only the page cache differs before it starts.
+            scan_options = dict(hash_algorithm=args.algorithm, max_workers=args.workers, cache_path=None,
+                                drop_page_cache=not args.keep_page_cache)
+            for cache_state in cache_states:
+                for attempt in range(1, args.repeat + 1):
+                    if cache_state == 'cold':
+                        drop_from_page_cache(root)
+                    else:
+                        read_into_page_cache(root)
+                    run = run_scan(root, scan_options)
+                    run.update({'case': case, 'cache': cache_state, 'attempt': attempt,
+                                'paths': paths, 'files': inodes, 'bytes': total_bytes})
+                    results['runs'].append(run)
+                    stats = run['stats']
+                    peak = f"{stats['peak_rss'] / MIB:.1f} MB" if stats['peak_rss'] else "n/a"
+                    print(f"  {cache_state} #{attempt}: {stats['wall_time']:.2f} s, {run['duplicate_sets']} sets, peak RSS {peak}")
+                    for stage in stats['stages']:
+                        print(f"    {stage['stage']:<28} {stage['wall_time']:>8.3f} s {stage['mb_per_s']:>9.1f} MB/s"
+                              f"  {stage['files_in']:>8} -> {stage['files_out']:<8}")
+            if not args.keep:
+                shutil.rmtree(root)
+    finally:
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}" + (f" (trees kept in {workdir})" if args.keep else ""))
+
+
+if __name__ == '__main__':
+    main()